@@ -0,0 +1,101 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+
+from .copy_sync import file_hash
+
+
+class ContentStore:
+    """Hidden sibling directory of the video directory holding one file per
+    distinct content, named by its BLAKE2b hash.
+
+    The files in the video directory are hardlinks to these objects, so the
+    same video arriving under different names is stored once and, if the
+    store already has it, linked instead of copied.  Sources are only hashed
+    if an object of the same size exists.  Objects no video directory links
+    to anymore are removed by collect().
+    """
+
+    def __init__(self, target):
+        target = os.path.abspath(target.rstrip('/'))
+        parent, name = os.path.split(target)
+        self.path = os.path.join(parent, '.{0}.objects'.format(name))
+        # size -> set of digests, the prefilter for lookup()
+        self._sizes = {}
+
+    def _object(self, digest):
+        return os.path.join(self.path, digest)
+
+    def load(self, directory, entries):
+        """Index the objects and add the files of directory that have a hash
+        in the manifest entries but no object yet (e.g. copied before the
+        store existed).
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._sizes = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                    self._sizes.setdefault(entry.stat().st_size, set()).add(entry.name)
+        for name, entry in entries.items():
+            digest = entry.get('hash')
+            path = os.path.join(directory, name)
+            if digest and os.path.isfile(path):
+                self.add(path, digest)
+
+    def lookup(self, path, size, digest=None):
+        """Return the object with the content of path and its digest, or
+        (None, digest) if there is none.  path is only read if an object of
+        the same size exists and digest (the BLAKE2b hex digest of path, if
+        already known) is not given.
+        """
+        digests = self._sizes.get(size)
+        if not digests:
+            return None, digest
+        if digest is None:
+            digest = file_hash(path)
+        if digest in digests and os.path.isfile(self._object(digest)):
+            return self._object(digest), digest
+        return None, digest
+
+    def add(self, path, digest):
+        """Add the file at path as the object for digest.  If there is one
+        already, path is replaced by a link to it.  Returns false if the
+        filesystem doesn't support hardlinks.
+        """
+        obj = self._object(digest)
+        try:
+            os.link(path, obj)
+        except FileExistsError:
+            if not os.path.samefile(path, obj):
+                self.link(obj, path)
+        except OSError:
+            return False
+        self._sizes.setdefault(os.stat(obj).st_size, set()).add(digest)
+        return True
+
+    def link(self, obj, path):
+        """Make path a link to the object obj, replacing any existing file."""
+        temp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.link')
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        os.link(obj, temp_path)
+        os.replace(temp_path, path)
+
+    def collect(self):
+        """Remove the objects that nothing links to anymore, returns how
+        many were removed.
+        """
+        removed = 0
+        if not os.path.isdir(self.path):
+            return removed
+        with os.scandir(self.path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                    if st.st_nlink == 1:
+                        os.remove(entry.path)
+                        self._sizes.get(st.st_size, set()).discard(entry.name)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
@@ -0,0 +1,195 @@
+# License: GNU GPLv2, see LICENSE.txt
+import errno
+import os
+from time import monotonic
+
+# Bytes per copy call, large enough to keep the USB bus busy and small enough
+# for regular progress updates.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Bytes between checkpoints of a copy, each one costs an fdatasync.
+CHECKPOINT_BYTES = 8 * CHUNK_SIZE
+
+# Errors telling that a kernel side copy is not possible for this pair of
+# files (e.g. across filesystems on older kernels), the next method is tried.
+_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+
+def _advise(fd, advice):
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+
+def _copy_range(fsrc, fdst, offset, size, callback):
+    """Copy with copy_file_range (Python 3.8+), returns the bytes copied."""
+    copied = offset
+    while copied < size:
+        n = os.copy_file_range(fsrc, fdst, min(CHUNK_SIZE, size - copied))
+        if n == 0:
+            break
+        copied += n
+        callback(copied)
+    return copied
+
+
+def _send_file(fsrc, fdst, offset, size, callback):
+    """Copy with sendfile, returns the bytes copied."""
+    copied = offset
+    while copied < size:
+        n = os.sendfile(fdst, fsrc, None, min(CHUNK_SIZE, size - copied))
+        if n == 0:
+            break
+        copied += n
+        callback(copied)
+    return copied
+
+
+def _read_write(fsrc, fdst, offset, size, callback, digests=()):
+    """Copy through a reused buffer, feeding the data to the digests on the
+    way.  Returns the bytes copied.
+    """
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    copied = offset
+    while True:
+        n = os.readv(fsrc, [buffer])
+        if n == 0:
+            break
+        for digest in digests:
+            digest.update(view[:n])
+        written = 0
+        while written < n:
+            written += os.write(fdst, view[written:n])
+        copied += n
+        callback(copied)
+    return copied
+
+
+def copy_file(src, dst, callback=None, fsync=False, digests=(), offset=0, checkpoint=None):
+    """Copy the contents of src to dst (created or truncated).  The data is
+    moved by the kernel (copy_file_range, sendfile) where possible, otherwise
+    through a large buffer.  callback(copied bytes) is called after every
+    chunk, with fsync the data is on disk when this returns.  If hashlib
+    digests are given the data goes through the buffer and is hashed while
+    it is copied, without reading it twice.
+
+    With an offset, dst is kept up to that offset and the copy continues
+    from there (the digests must already contain the data before it).
+    checkpoint(copied bytes) is called every CHECKPOINT_BYTES once the data
+    up to there is on disk.  Returns the number of bytes copied, including
+    the offset.
+    """
+    if callback is None:
+        callback = lambda copied: None
+    fsrc = os.open(src, os.O_RDONLY)
+    try:
+        size = os.fstat(fsrc).st_size
+        fdst = os.open(dst, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if offset == 0 else 0), 0o644)
+        try:
+            if offset:
+                os.ftruncate(fdst, offset)
+                os.lseek(fdst, offset, os.SEEK_SET)
+                os.lseek(fsrc, offset, os.SEEK_SET)
+            if checkpoint is not None:
+                progress = callback
+                last = [offset]
+
+                def callback(copied):
+                    if copied - last[0] >= CHECKPOINT_BYTES:
+                        os.fdatasync(fdst)
+                        checkpoint(copied)
+                        last[0] = copied
+                    progress(copied)
+            if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+                _advise(fsrc, os.POSIX_FADV_SEQUENTIAL)
+            copied = offset
+            methods = []
+            if not digests:
+                if hasattr(os, 'copy_file_range'):
+                    methods.append(_copy_range)
+                if hasattr(os, 'sendfile'):
+                    methods.append(_send_file)
+            for method in methods:
+                try:
+                    copied = method(fsrc, fdst, copied, size, callback)
+                    break
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+            # Copies what the kernel couldn't (or everything when hashing)
+            # and, as files may grow while they are copied, the rest too.
+            copied = _read_write(fsrc, fdst, copied, size, callback, digests)
+            if hasattr(os, 'POSIX_FADV_DONTNEED'):
+                # The source won't be read again, don't push other data out
+                # of the page cache for it.
+                _advise(fsrc, os.POSIX_FADV_DONTNEED)
+            if fsync:
+                os.fsync(fdst)
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+    return copied
+
+
+class CopyProgress:
+    """Progress of copying a batch of files.
+
+    Counts the bytes of all files together and calls draw(self) at most
+    rate times per second (and once more when the batch is done), so drawing
+    the progress never slows the copy down.
+    """
+
+    def __init__(self, total_bytes, total_files, draw, rate=10):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.done_bytes = 0
+        self.file_index = 0
+        self.file_name = None
+        self._file_bytes = 0
+        self._draw = draw
+        self._interval = 1.0 / rate
+        self._start = monotonic()
+        self._last_draw = None
+
+    @property
+    def copied_bytes(self):
+        return self.done_bytes + self._file_bytes
+
+    @property
+    def fraction(self):
+        if self.total_bytes <= 0:
+            return 1.0
+        return min(1.0, self.copied_bytes / self.total_bytes)
+
+    @property
+    def bytes_per_second(self):
+        elapsed = monotonic() - self._start
+        return self.copied_bytes / elapsed if elapsed > 0 else 0.0
+
+    def start_file(self, name):
+        self.file_index += 1
+        self.file_name = name
+        self._file_bytes = 0
+        self._maybe_draw(True)
+
+    def update(self, copied):
+        """Report the bytes copied of the current file so far."""
+        self._file_bytes = copied
+        self._maybe_draw()
+
+    def finish_file(self, size=None):
+        self.done_bytes += self._file_bytes if size is None else size
+        self._file_bytes = 0
+
+    def finish(self):
+        self._maybe_draw(True)
+
+    def _maybe_draw(self, force=False):
+        now = monotonic()
+        if force or self._last_draw is None or now - self._last_draw >= self._interval:
+            self._last_draw = now
+            self._draw(self)
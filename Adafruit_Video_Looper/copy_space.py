@@ -0,0 +1,72 @@
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import os
+
+# Eviction policies: which files of the video directory make room first.
+EVICTION_POLICIES = ('none', 'least_recently_played', 'oldest_added')
+
+SpacePlan = collections.namedtuple('SpacePlan', 'fits needed available evict free_first')
+SpacePlan.__doc__ = """Whether a copy fits.  needed and available are bytes, evict lists the
+names to remove to make it fit and free_first tells if the files that are
+removed (the evicted and the dropped ones) have to be deleted before copying
+instead of only with the swap."""
+
+
+def available_bytes(path, reserve=0):
+    """Return the bytes that can be written to the filesystem of path,
+    keeping reserve bytes free.
+    """
+    st = os.statvfs(path)
+    return max(0, st.f_bavail * st.f_frsize - reserve)
+
+
+def freed_bytes(path, links=1):
+    """Return the bytes deleting path frees, 0 if other hardlinks than the
+    expected number of links keep its data.
+    """
+    st = os.stat(path)
+    return st.st_blocks * 512 if st.st_nlink <= links else 0
+
+
+def eviction_order(names, added, played, policy):
+    """Return names in the order they are evicted: least recently played
+    or oldest added first.  added maps names to the time they were added,
+    played maps them to a list of times they were last played (from any of
+    their paths).  Files that were never played count as played when they
+    were added.
+    """
+    if policy != 'least_recently_played':
+        return sorted(names, key=lambda name: added.get(name, 0))
+    return sorted(names, key=lambda name: max([added.get(name, 0)] + played.get(name, [])))
+
+
+def plan_space(needed, available, dropped, library, candidates, max_size=0,
+               can_free_first=True):
+    """Plan making room for needed bytes.  available are the free bytes,
+    dropped the bytes freed by deleting the files that are replaced or
+    removed anyway and library the size of the files that stay (for
+    max_size, 0 for no limit).  candidates is a list of (name, size, freed
+    bytes) of files that may be evicted, in the order they should be.
+    Without can_free_first the files may only be removed with the swap
+    (they are played meanwhile), so they don't make room for the copy.
+    """
+    # Room on the disk only comes from deleting files before copying, with
+    # the swap would be too late.
+    free_first = needed > available and can_free_first
+    space = available + (dropped if free_first else 0)
+
+    def fits(evicted):
+        return needed <= space and (max_size <= 0 or library - evicted + needed <= max_size)
+
+    evict = []
+    evicted = 0
+    for name, size, name_freed in candidates:
+        if fits(evicted):
+            break
+        evict.append(name)
+        evicted += size
+        if free_first:
+            space += name_freed
+    if not fits(evicted):
+        return SpacePlan(False, needed, available, [], False)
+    return SpacePlan(True, needed, available, evict, free_first)
@@ -0,0 +1,173 @@
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import hashlib
+import json
+import os
+import time
+
+# Hidden, so the file readers ignore it, and inside the target directory so
+# it always describes the files it is stored with.
+MANIFEST_NAME = '.video_looper_manifest.json'
+
+# FAT stores mtimes with a resolution of 2 seconds.
+MTIME_TOLERANCE_NS = 2 * 10**9
+
+SyncPlan = collections.namedtuple('SyncPlan', 'copy delete unchanged')
+SyncPlan.__doc__ = """What a sync has to do.  copy is a list of (source path, name, size)
+of new or changed files, delete a list of names that are gone from the
+source and unchanged the number of files that are already up to date."""
+
+
+def plan_bytes(plan):
+    """Return the number of bytes a plan copies."""
+    return sum(size for _, _, size in plan.copy)
+
+
+def format_size(size):
+    """Return a number of bytes in a human readable form."""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{0:.1f} {1}'.format(size, unit)
+        size /= 1024.0
+    return '{0:.1f} GB'.format(size)
+
+
+# Checksum files that may be on a drive, as written by b2sum and sha256sum,
+# with the hash algorithm they use.
+CHECKSUM_FILES = (('B2SUMS', 'blake2b'), ('SHA256SUMS', 'sha256'))
+
+
+def read_checksums(directory):
+    """Read the checksum file in directory, if there is one.  Returns a
+    tuple of the hashlib algorithm name and a dict of file name -> hex digest,
+    or (None, {}).
+    """
+    for base, algorithm in CHECKSUM_FILES:
+        for name in (base, base + '.txt', base.lower(), base.lower() + '.txt'):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            checksums = {}
+            with open(path, 'r', errors='replace') as f:
+                for line in f:
+                    parts = line.rstrip('\r\n').split(None, 1)
+                    if len(parts) != 2:
+                        continue
+                    digest, file_name = parts
+                    # '*' marks binary mode, paths are relative to the drive.
+                    file_name = os.path.normpath(file_name.lstrip('*'))
+                    checksums[file_name] = digest.lower()
+            return algorithm, checksums
+    return None, {}
+
+
+def new_digest(algorithm='blake2b'):
+    """Return a new hashlib object, BLAKE2b is the hash of the manifest."""
+    return hashlib.new(algorithm)
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Return the hex BLAKE2b digest of a file."""
+    digest = new_digest()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Record of the files copied into a target directory.
+
+    For every name the size and mtime of the source it was copied from and of
+    the resulting target file are kept (plus a hash if one was computed), so
+    the next sync can tell unchanged files apart without reading them.  The
+    time a file was added tells the oldest ones apart for eviction.
+    """
+
+    def __init__(self, directory):
+        self._path = os.path.join(directory, MANIFEST_NAME)
+        self.entries = {}
+        try:
+            with open(self._path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data.get('files'), dict):
+                self.entries = data['files']
+        except (OSError, ValueError, AttributeError):
+            # No or a broken manifest, files are compared by size and mtime.
+            pass
+
+    def record(self, name, source_stat, target_path, digest=None):
+        st = os.stat(target_path)
+        entry = {'source_size': source_stat.st_size,
+                 'source_mtime_ns': source_stat.st_mtime_ns,
+                 'size': st.st_size,
+                 'mtime_ns': st.st_mtime_ns,
+                 'added': time.time()}
+        if digest is not None:
+            entry['hash'] = digest
+        self.entries[name] = entry
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+
+    def save(self):
+        """Write the manifest atomically."""
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': 1, 'files': self.entries}, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._path)
+
+
+def _is_unchanged(source_stat, target_stat, entry):
+    if target_stat is None or target_stat.st_size != source_stat.st_size:
+        return False
+    if entry is not None:
+        # The target must still be the file that was copied, from the same
+        # version of the source.
+        return (entry.get('source_size') == source_stat.st_size and
+                entry.get('source_mtime_ns') == source_stat.st_mtime_ns and
+                entry.get('size') == target_stat.st_size and
+                entry.get('mtime_ns') == target_stat.st_mtime_ns)
+    # Copied before there was a manifest: copies keep the source mtime.
+    return abs(target_stat.st_mtime_ns - source_stat.st_mtime_ns) < MTIME_TOLERANCE_NS
+
+
+def _list_files(directory, is_media):
+    files = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.startswith('.') or not is_media(entry.name):
+                continue
+            try:
+                if entry.is_file():
+                    files[entry.name] = entry
+            except OSError:
+                continue
+    return files
+
+
+def plan_sync(source, target, is_media, manifest, use_hash=False):
+    """Compare the media files (is_media(name) is true) of the source and
+    target directories.  With use_hash, files whose size and mtime match are
+    additionally compared by the hash in the manifest, which reads the source
+    file completely.
+    """
+    sources = _list_files(source, is_media)
+    targets = _list_files(target, is_media)
+    copy = []
+    unchanged = 0
+    for name in sorted(sources):
+        source_stat = sources[name].stat()
+        target_stat = targets[name].stat() if name in targets else None
+        entry = manifest.entries.get(name)
+        same = _is_unchanged(source_stat, target_stat, entry)
+        if same and use_hash:
+            same = entry is not None and entry.get('hash') == file_hash(sources[name].path)
+        if same:
+            unchanged += 1
+        else:
+            copy.append((sources[name].path, name, source_stat.st_size))
+    delete = sorted(name for name in targets if name not in sources)
+    return SyncPlan(copy, delete, unchanged)
@@ -2,31 +2,225 @@
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
 import os
+import stat
+from time import monotonic
+
+from . import inotify
+
+_WATCH_MASK = (inotify.IN_CREATE | inotify.IN_MODIFY | inotify.IN_CLOSE_WRITE |
+               inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_DELETE |
+               inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_ONLYDIR)
+
+# Seconds without writes after which a file that was never closed (e.g. a
+# hardlink, or a writer that died) counts as written.
+WRITE_TIMEOUT = 30
+
 
 class DirectoryReader:
 
     def __init__(self, config):
         """Create an instance of a file reader that just reads a single
-        directory on disk.
+        directory on disk.  Changes are picked up through inotify, with a
+        fallback to comparing directory snapshots if it is not available.
+        Subdirectories are watched as deep as scan_depth searches them.
         """
         self._load_config(config)
-        self._filecount = self.count_files()
+        # path relative to the directory -> monotonic time at which the file
+        # counts as settled.
+        self._pending = {}
+        self._changed = False
+        self._wd = None
+        # watch descriptor -> relative path of the watched directory
+        self._watches = {}
+        try:
+            self._inotify = inotify.Inotify()
+        except OSError:
+            self._inotify = None
+        self._add_watch()
+        self._snapshot = self._take_snapshot()
 
     def _load_config(self, config):
         self._path = config.get('directory', 'path')
+        self._settle_time = config.getfloat('directory', 'settle_time')
+        self._max_depth = config.getint('video_looper', 'scan_depth')
+
+    def _within_depth(self, relpath):
+        """Return true if the directory at relpath is searched for files."""
+        depth = 0 if relpath == '' else relpath.count(os.sep) + 1
+        return self._max_depth < 0 or depth <= self._max_depth
+
+    def _add_watch(self):
+        if self._inotify is None or self._wd is not None:
+            return
+        try:
+            self._wd = self._inotify.add_watch(self._path, _WATCH_MASK)
+        except OSError:
+            self._wd = None
+            return
+        self._watches = {self._wd: ''}
+        self._watch_subdirectories('')
+
+    def _watch_subdirectories(self, relpath, settle=False):
+        """Watch the subdirectories of relpath that are searched.  With
+        settle the files found in them are held back like new ones, they
+        might have been written before the watch existed.
+        """
+        try:
+            with os.scandir(os.path.join(self._path, relpath)) as it:
+                entries = [entry for entry in it if not entry.name.startswith('.')]
+        except OSError:
+            return
+        now = monotonic()
+        for entry in entries:
+            child = os.path.join(relpath, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                if not self._within_depth(child):
+                    continue
+                try:
+                    wd = self._inotify.add_watch(entry.path, _WATCH_MASK)
+                except OSError:
+                    continue
+                self._watches[wd] = child
+                self._watch_subdirectories(child, settle)
+            elif settle:
+                self._pending[child] = now + self._settle_time
+
+    def _unwatch(self, relpath):
+        """Stop watching the directory at relpath and its subdirectories and
+        forget their pending files.
+        """
+        prefix = relpath + os.sep
+        for wd, watched in list(self._watches.items()):
+            if watched == relpath or watched.startswith(prefix):
+                del self._watches[wd]
+                self._inotify.rm_watch(wd)
+        for pending in [p for p in self._pending if p.startswith(prefix)]:
+            del self._pending[pending]
+
+    def _take_snapshot(self):
+        """Return the paths, sizes and mtimes of the files in the searched
+        directories.
+        """
+        snapshot = set()
+        directories = ['']
+        while directories:
+            relpath = directories.pop()
+            try:
+                with os.scandir(os.path.join(self._path, relpath)) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        child = os.path.join(relpath, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            if self._within_depth(child):
+                                directories.append(child)
+                            continue
+                        st = entry.stat()
+                        snapshot.add((child, st.st_size, st.st_mtime_ns))
+            except OSError:
+                pass
+        return frozenset(snapshot)
+
+    def _process_events(self):
+        now = monotonic()
+        for wd, mask, cookie, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                # Events were lost, treat everything as changed.
+                self._changed = True
+                continue
+            directory = self._watches.get(wd)
+            if mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_IGNORED):
+                if wd == self._wd:
+                    for other in self._watches:
+                        if other != wd:
+                            self._inotify.rm_watch(other)
+                    self._wd = None
+                    self._watches = {}
+                    self._pending.clear()
+                    self._changed = True
+                # Subdirectories are handled by the event of their parent.
+                continue
+            if directory is None or not name or name.startswith('.'):
+                continue
+            relpath = os.path.join(directory, name)
+            if mask & inotify.IN_ISDIR:
+                # Directories are never written to, no need to settle.
+                self._changed = True
+                if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO) and \
+                        self._within_depth(relpath):
+                    try:
+                        self._watches[self._inotify.add_watch(
+                            os.path.join(self._path, relpath), _WATCH_MASK)] = relpath
+                    except OSError:
+                        continue
+                    self._watch_subdirectories(relpath, settle=True)
+                elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                    self._unwatch(relpath)
+            elif mask & (inotify.IN_CREATE | inotify.IN_MODIFY):
+                # Probably still being written, hold it back until it is
+                # closed.  Symlinks and other non-regular files are never
+                # written to.
+                timeout = WRITE_TIMEOUT if self._is_regular(relpath) else 0
+                self._pending[relpath] = now + max(self._settle_time, timeout)
+            elif mask & (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO):
+                self._pending[relpath] = now + self._settle_time
+            elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                self._pending.pop(relpath, None)
+                self._changed = True
+
+    def _is_regular(self, relpath):
+        try:
+            return stat.S_ISREG(os.lstat(os.path.join(self._path, relpath)).st_mode)
+        except OSError:
+            return False
+
+    def _settle(self):
+        now = monotonic()
+        for relpath, deadline in list(self._pending.items()):
+            if deadline <= now:
+                del self._pending[relpath]
+                self._changed = True
 
     def search_paths(self):
         """Return a list of paths to search for files."""
         return [self._path]
 
     def is_changed(self):
-        """Return true if the number of files in the paths have changed."""
-        current_count = self.count_files()
-        if current_count != self._filecount:
-            self._filecount = current_count
-            return True
-        else:
+        """Return true if files in the path were added, removed, renamed or
+        rewritten.  New or modified files are only reported once writing them
+        has finished and settle_time seconds passed without further writes.
+        """
+        if self._wd is None:
+            # Not watching (yet), compare snapshots and retry the watch.
+            self._add_watch()
+            snapshot = self._take_snapshot()
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                return True
             return False
+        self._process_events()
+        self._settle()
+        changed = self._changed
+        self._changed = False
+        return changed
+
+    def is_file_ready(self, path):
+        """Return false if the file is still being written or settling."""
+        if not self._pending:
+            return True
+        return os.path.relpath(path, self._path) not in self._pending
+
+    def fileno(self):
+        """Return the inotify file descriptor or None if not watching."""
+        if self._wd is None:
+            return None
+        return self._inotify.fileno()
+
+    def next_timeout(self):
+        """Return the seconds until the next pending file settles."""
+        if not self._pending:
+            return None
+        return max(0, min(self._pending.values()) - monotonic())
 
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
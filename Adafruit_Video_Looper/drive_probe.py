@@ -0,0 +1,151 @@
+# License: GNU GPLv2, see LICENSE.txt
+import json
+import os
+import struct
+from time import monotonic, time
+
+# How a drive is used, see choose_mode().
+DIRECT = 'direct'
+STAGE = 'stage'
+COPY = 'copy'
+
+# Containers with an ISO base media (MP4) structure, their duration is in the
+# mvhd box.
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.3gp')
+
+
+def measure_throughput(path, probe_bytes=32 * 1024 * 1024, max_seconds=3.0):
+    """Return the sequential read speed in bytes per second measured by
+    reading up to probe_bytes from the start of path (for at most max_seconds),
+    None if nothing could be read.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            # Cached pages would measure the RAM instead of the drive.
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        buffer = bytearray(1024 * 1024)
+        total = 0
+        start = monotonic()
+        while total < probe_bytes and monotonic() - start < max_seconds:
+            n = os.readv(fd, [buffer])
+            if n == 0:
+                break
+            total += n
+        elapsed = monotonic() - start
+    finally:
+        os.close(fd)
+    if total == 0 or elapsed <= 0:
+        return None
+    return total / elapsed
+
+
+def _boxes(f, start, end):
+    """Yield (type, content start, end) of the MP4 boxes between start and
+    end.
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield kind, offset + header_size, offset + size
+        offset += size
+
+
+def mp4_duration(path):
+    """Return the duration in seconds from the movie header (mvhd) of an MP4
+    file, None if it has none.
+    """
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        for kind, start, stop in _boxes(f, 0, end):
+            if kind != b'moov':
+                continue
+            for inner, content, _ in _boxes(f, start, stop):
+                if inner != b'mvhd':
+                    continue
+                f.seek(content)
+                version = f.read(4)[0]
+                if version == 1:
+                    f.seek(16, os.SEEK_CUR)
+                    timescale, duration = struct.unpack('>IQ', f.read(12))
+                else:
+                    f.seek(8, os.SEEK_CUR)
+                    timescale, duration = struct.unpack('>II', f.read(8))
+                return duration / timescale if timescale and duration else None
+            return None
+    return None
+
+
+def estimate_bitrate(path):
+    """Return the average bitrate of a media file in bytes per second, None
+    if its duration is unknown.
+    """
+    if os.path.splitext(path)[1].lower() not in MP4_EXTENSIONS:
+        return None
+    try:
+        duration = mp4_duration(path)
+    except (OSError, struct.error, IndexError):
+        return None
+    if not duration:
+        return None
+    return os.path.getsize(path) / duration
+
+
+def choose_mode(throughput, bitrates, margin):
+    """Decide how to use a drive that reads throughput bytes per second for
+    media with the given bitrates (bytes per second): play directly if it is
+    margin times faster than all of them, stage (copy the files it is too
+    slow for) if it is for some and copy everything otherwise.
+    """
+    if throughput is None or not bitrates:
+        return COPY
+    fast_enough = [throughput >= bitrate * margin for bitrate in bitrates]
+    if all(fast_enough):
+        return DIRECT
+    if any(fast_enough):
+        return STAGE
+    return COPY
+
+
+class ThroughputCache:
+    """Measured read speeds of drives by filesystem id, kept in a JSON file
+    so a known drive isn't measured again.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        try:
+            with open(path, 'r') as f:
+                self._entries = json.load(f)
+            if not isinstance(self._entries, dict):
+                self._entries = {}
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, source):
+        entry = self._entries.get(source)
+        return entry.get('bytes_per_second') if isinstance(entry, dict) else None
+
+    def put(self, source, bytes_per_second):
+        self._entries[source] = {'bytes_per_second': bytes_per_second, 'measured': time()}
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._path)
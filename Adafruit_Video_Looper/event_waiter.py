@@ -0,0 +1,87 @@
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import fcntl
+import os
+import select
+import signal
+import threading
+
+
+class EventWaiter:
+    """Blocks the main loop until something happens that it has to react to.
+
+    Wakeups come from:
+    - commands posted by the input threads (keyboard, GPIO) through a pipe,
+    - signals, most importantly SIGCHLD when a player process exits,
+    - file descriptors of readers and players (udev netlink, inotify, ...),
+    - an optional timeout for things that are only time based.
+    """
+
+    def __init__(self):
+        self._commands = collections.deque()
+        self._lock = threading.Lock()
+        self._poll = select.poll()
+        self._fds = set()
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._poll.register(self._read_fd, select.POLLIN)
+        self.signals_enabled = self._setup_signals()
+
+    def _setup_signals(self):
+        """Route SIGCHLD (and every other handled signal) into the wakeup pipe
+        so a player exiting interrupts the wait immediately.  Only possible
+        from the main thread, returns False otherwise.
+        """
+        try:
+            signal.set_wakeup_fd(self._write_fd)
+        except ValueError:
+            return False
+        # A Python level handler is required, with SIG_DFL the signal is
+        # discarded before it reaches the wakeup fd.
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        return True
+
+    def watch(self, fds):
+        """Set the file descriptors (besides the internal pipe) to wait on."""
+        fds = set(fds)
+        for fd in self._fds - fds:
+            self._poll.unregister(fd)
+        for fd in fds - self._fds:
+            self._poll.register(fd, select.POLLIN)
+        self._fds = fds
+
+    def post(self, command, *args):
+        """Queue a command for the main loop and wake it up. Thread safe."""
+        with self._lock:
+            self._commands.append((command, args))
+        self.wake()
+
+    def wake(self):
+        """Wake up the main loop without a command."""
+        try:
+            os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            # Pipe is full, the main loop is going to wake up anyway.
+            pass
+
+    def wait(self, timeout=None):
+        """Wait until an event arrives or timeout (in seconds) expires.  None
+        waits forever.  Returns the list of (command, args) tuples posted since
+        the last call, which might be empty.
+        """
+        if not self._commands:
+            self._poll.poll(None if timeout is None else max(0, timeout * 1000))
+        self._drain()
+        with self._lock:
+            commands = list(self._commands)
+            self._commands.clear()
+        return commands
+
+    def _drain(self):
+        try:
+            while os.read(self._read_fd, 512):
+                pass
+        except BlockingIOError:
+            pass
@@ -1,9 +1,7 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
-import os
-import subprocess
-import time
+from .process_manager import PlayerProcess
 
 
 class HelloVideoPlayer:
@@ -13,6 +11,7 @@ class HelloVideoPlayer:
         background.
         """
         self._process = None
+        self._last_stop = None
         self._load_config(config)
 
     def _load_config(self, config):
@@ -39,9 +38,8 @@ class HelloVideoPlayer:
 
         args.append(movie.target)       # Add movie file path.
         # Run hello_video process and direct standard output to /dev/null.
-        self._process = subprocess.Popen(args,
-                                         stdout=open(os.devnull, 'wb'),
-                                         close_fds=True)
+        self._process = PlayerProcess(args)
+
     def pause(self):
         #todo add pause to HelloVideoPlayer
         print("pausing is not supported in HelloVideoPlayer")
@@ -53,28 +51,24 @@ class HelloVideoPlayer:
         """Return true if the video player is running, false otherwise."""
         if self._process is None:
             return False
-        self._process.poll()
-        return self._process.returncode is None
+        return self._process.poll() is None
 
     def stop(self, block_timeout_sec=0):
         """Stop the video player.  block_timeout_sec is how many seconds to
         block waiting for the player to stop before moving on.
         """
-        # Stop the player if it's running.
-        if self._process is not None and self._process.returncode is None:
-            # process.kill() doesn't seem to work reliably if USB drive is
-            # removed, instead just run a kill -9 on it.
-            subprocess.call(['kill', '-9', str(self._process.pid)])
-        # If a blocking timeout was specified, wait up to that amount of time
-        # for the process to stop.
-        start = time.time()
-        while self._process is not None and self._process.returncode is None:
-            if (time.time() - start) >= block_timeout_sec:
-                break
-            time.sleep(0)
+        # Stop the player if it's running.  Its process group is signalled
+        # directly instead of forking a kill command.
+        if self._process is not None and self._process.poll() is None:
+            self._process.stop(block_timeout_sec)
+            self._last_stop = self._process.last_stop
         # Let the process be garbage collected.
         self._process = None
 
+    def stats(self):
+        """Return statistics about the last time the player was stopped."""
+        return dict(self._last_stop) if self._last_stop else {}
+
     @staticmethod
     def can_loop_count():
         return True
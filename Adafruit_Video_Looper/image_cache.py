@@ -0,0 +1,124 @@
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import os
+import threading
+
+
+class ImageCache:
+    """Memory bounded LRU cache of images prepared for display.
+
+    load(path) returns a tuple whose first item is a pygame surface and whose
+    optional third item is a list of (surface, delay) animation frames, it is
+    called at most once per file (keyed by path, size and mtime) as long as
+    the result stays in the cache.  A background thread loads the paths given
+    to prefetch() so they are ready when they get displayed.
+    """
+
+    def __init__(self, load, max_bytes):
+        self._load = load
+        self._max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._loading = set()
+        self._queue = []
+        self._lock = threading.Condition()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path):
+        st = os.stat(path)
+        return (path, st.st_size, st.st_mtime_ns)
+
+    @staticmethod
+    def _size_of(value):
+        surfaces = [value[0]]
+        if len(value) > 2 and value[2]:
+            surfaces.extend(frame[0] for frame in value[2])
+        return sum(surface.get_pitch() * surface.get_height() for surface in surfaces)
+
+    def _store(self, key, value):
+        size = self._size_of(value)
+        with self._lock:
+            if size > self._max_bytes or key in self._entries:
+                return
+            while self._entries and self._bytes + size > self._max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+    def _wait_for(self, key):
+        """Return the cached value for key, waiting if it is being loaded
+        right now.  Must be called with the lock held.
+        """
+        while key in self._loading:
+            self._lock.wait()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, path):
+        """Return the loaded image for path, from the cache if possible."""
+        key = self._key(path)
+        with self._lock:
+            value = self._wait_for(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            self._loading.add(key)
+        try:
+            value = self._load(path)
+        finally:
+            with self._lock:
+                self._loading.discard(key)
+                self._lock.notify_all()
+        self._store(key, value)
+        return value
+
+    def prefetch(self, paths):
+        """Load the given paths in the background, replacing the paths of
+        earlier calls that were not loaded yet.
+        """
+        with self._lock:
+            self._queue = list(paths)
+            self._lock.notify_all()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._prefetch_worker, daemon=True)
+                self._thread.start()
+
+    def _prefetch_worker(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._lock.wait()
+                path = self._queue.pop(0)
+            try:
+                key = self._key(path)
+            except OSError:
+                continue
+            with self._lock:
+                if key in self._entries or key in self._loading:
+                    continue
+                self._loading.add(key)
+            try:
+                value = self._load(path)
+            except Exception:
+                # Errors surface when the image is actually displayed.
+                value = None
+            finally:
+                with self._lock:
+                    self._loading.discard(key)
+                    self._lock.notify_all()
+            if value is not None:
+                self._store(key, value)
+
+    def stats(self):
+        """Return counters of the cache."""
+        with self._lock:
+            return {'cache_hits': self.hits, 'cache_misses': self.misses,
+                    'cache_mb': round(self._bytes / 1048576, 1)}
@@ -0,0 +1,170 @@
+# License: GNU GPLv2, see LICENSE.txt
+import pygame
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Identifies how images are decoded, images decoded differently (e.g. without
+# EXIF orientation) must not be mixed up in caches.
+DECODER = 'pil' if Image is not None else 'pygame'
+
+_ORIENTATION_TAG = 0x0112
+
+# Formats whose extra frames are an animation (unlike e.g. the preview images
+# in MPO JPEGs).
+_ANIMATED_FORMATS = ('GIF', 'PNG', 'WEBP')
+
+# EXIF orientation -> transposition that makes the image upright, the same
+# table as PIL.ImageOps.exif_transpose (which needs a newer Pillow).
+_TRANSPOSE = {} if Image is None else {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def fit_image(image_size, screen_size, scale, center):
+    """Return the size an image is displayed at and the position of its top
+    left corner on the screen.
+    """
+    image_x = 0
+    image_y = 0
+    screen_w, screen_h = screen_size
+    image_w, image_h = image_size
+    new_image_w, new_image_h = image_size
+    screen_aspect_ratio = screen_w / screen_h
+    photo_aspect_ratio = image_w / image_h
+
+    if scale:
+        if screen_aspect_ratio < photo_aspect_ratio:  # Width is binding
+            new_image_w = screen_w
+            new_image_h = int(new_image_w / photo_aspect_ratio)
+        elif screen_aspect_ratio > photo_aspect_ratio:  # Height is binding
+            new_image_h = screen_h
+            new_image_w = int(new_image_h * photo_aspect_ratio)
+        else:  # Images have the same aspect ratio
+            new_image_w, new_image_h = screen_w, screen_h
+
+    if center:
+        if screen_aspect_ratio < photo_aspect_ratio:
+            image_y = (screen_h - new_image_h) // 2
+        elif screen_aspect_ratio > photo_aspect_ratio:
+            image_x = (screen_w - new_image_w) // 2
+
+    return (new_image_w, new_image_h), (image_x, image_y)
+
+
+def _orientation(image):
+    try:
+        if hasattr(image, 'getexif'):
+            exif = image.getexif()
+        else:
+            exif = image._getexif() or {}
+        return exif.get(_ORIENTATION_TAG, 1)
+    except Exception:
+        # Broken EXIF data is common, show the image as it is stored.
+        return 1
+
+
+def _load_with_pil(path, screen_size, scale):
+    with Image.open(path) as image:
+        transpose = _TRANSPOSE.get(_orientation(image))
+        if scale and image.format == 'JPEG':
+            # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while still
+            # covering the size the image is displayed at.
+            size = image.size
+            if transpose in (Image.TRANSPOSE, Image.ROTATE_270, Image.TRANSVERSE, Image.ROTATE_90):
+                size = size[::-1]
+            fitted, _ = fit_image(size, screen_size, True, False)
+            if size != image.size:
+                fitted = fitted[::-1]
+            image.draft('RGB', fitted)
+        if transpose is not None:
+            image = image.transpose(transpose)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        return pygame.image.fromstring(image.tobytes(), image.size, image.mode)
+
+
+def load_image(path, screen_size, scale):
+    """Load an image into a pygame surface.  If Pillow is available it is used
+    to decode JPEGs at a reduced resolution that still covers the screen (when
+    they get scaled anyway) and to apply the EXIF orientation.  Without it, or
+    for files Pillow can't read, pygame loads the image at full size.
+    """
+    if Image is not None:
+        try:
+            return _load_with_pil(path, screen_size, scale)
+        except (OSError, ValueError, SyntaxError):
+            pass
+    return pygame.image.load(path)
+
+
+def may_be_animated(path):
+    """Return false if path is in none of the formats that can be animated,
+    only reads the signature at the start of the file.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(12)
+    except OSError:
+        return False
+    return header[:4] == b'GIF8' or header[:8] == b'\x89PNG\r\n\x1a\n' or \
+        (header[:4] == b'RIFF' and header[8:12] == b'WEBP')
+
+
+def is_animated(path):
+    """Return true if path is an animated image (GIF, APNG, ...) Pillow can
+    read.
+    """
+    if Image is None or not may_be_animated(path):
+        return False
+    try:
+        with Image.open(path) as image:
+            return image.format in _ANIMATED_FORMATS and getattr(image, 'is_animated', False)
+    except (OSError, ValueError, SyntaxError):
+        return False
+
+
+def load_frames(path, screen_size, scale, max_bytes):
+    """Decode all frames of an animated image, fitted to the screen.  Returns
+    a list of [surface, delay in seconds], or None for still images.  If the
+    frames would need more than max_bytes, only every n-th frame is kept (and
+    shown for the delays of the dropped ones).
+    """
+    if Image is None or not may_be_animated(path):
+        return None
+    try:
+        with Image.open(path) as image:
+            frame_count = getattr(image, 'n_frames', 1)
+            if image.format not in _ANIMATED_FORMATS or frame_count <= 1:
+                return None
+            size, _ = fit_image(image.size, screen_size, scale, False)
+            step = max(1, -(-frame_count * size[0] * size[1] * 4 // max_bytes))
+            frames = []
+            for index in range(frame_count):
+                image.seek(index)
+                duration = image.info.get('duration') or 0
+                # Like browsers, treat missing or tiny delays as 100ms.
+                delay = duration / 1000.0 if duration > 10 else 0.1
+                if index % step:
+                    frames[-1][1] += delay
+                    continue
+                frame = image.convert('RGBA')
+                if frame.split()[3].getextrema()[0] == 255:
+                    # Opaque frames don't need to be blended.
+                    frame = frame.convert('RGB')
+                surface = pygame.image.fromstring(frame.tobytes(), frame.size, frame.mode)
+                if surface.get_size() != size:
+                    surface = pygame.transform.scale(surface, size)
+                frames.append([surface, delay])
+            return frames
+    except (OSError, ValueError, SyntaxError, EOFError):
+        return None
@@ -3,6 +3,11 @@
 import os, pygame
 from time import monotonic
 
+from .image_cache import ImageCache
+from .image_decoder import fit_image, load_frames, load_image
+from .rendition_cache import RenditionCache
+from .transitions import TransitionEngine
+
 class ImagePlayer:
 
     def __init__(self, config, screen, bgimage):
@@ -14,6 +19,26 @@ class ImagePlayer:
         self._startTime = 0
         self._bgimage = bgimage
         self._isPaused = False
+        # True once the end of the display time was handled by update().
+        self._ended = True
+        # Frames of the animated image that is shown, with the index of the
+        # current one and when the next one is due.
+        self._frames = None
+        self._frame_index = 0
+        self._frame_due = None
+        self._frame_position = (0, 0)
+        self._cache = ImageCache(self._load_image, self._cache_size * 1024 * 1024)
+        self._renditions = None
+        if self._disk_cache_size > 0:
+            try:
+                self._renditions = RenditionCache(
+                    os.path.join(self._state_dir, 'image_cache'),
+                    self._disk_cache_size * 1024 * 1024, self._size, self._scale, self._center)
+            except OSError as e:
+                print('Image disk cache disabled: {0}'.format(e))
+        self._transition = TransitionEngine(self._screen, self._draw_background,
+                                            self._frame_rate, self._transition_duration,
+                                            self._ken_burns_zoom)
 
     def _load_config(self, config):
         self._extensions = config.get('image_player', 'extensions') \
@@ -27,6 +52,13 @@ class ImagePlayer:
         self._scale = config.getboolean('image_player', 'scale') 
         self._center = config.getboolean('image_player', 'center') 
         self._wait_time = config.getint('video_looper', 'wait_time')
+        self._cache_size = config.getint('image_player', 'cache_size')
+        self._preload_count = config.getint('image_player', 'preload_count')
+        self._disk_cache_size = config.getint('image_player', 'disk_cache_size')
+        self._state_dir = config.get('video_looper', 'state_dir')
+        self._transition_duration = config.getfloat('image_player', 'transition_duration')
+        self._ken_burns_zoom = config.getfloat('image_player', 'ken_burns_zoom')
+        self._frame_rate = config.getint('image_player', 'frame_rate')
 
     def supported_extensions(self):
         """Return list of supported file extensions."""
@@ -43,70 +75,170 @@ class ImagePlayer:
         
         imagepath = image.target
 
+        self._frames = None
         if imagepath != "" and os.path.isfile(imagepath):
-            self._blank_screen(False)
-            pyimage = pygame.image.load(imagepath)
-            image_x = 0
-            image_y = 0
-            screen_w, screen_h = self._size
-            image_w, image_h = pyimage.get_size()
-            new_image_w, new_image_h = pyimage.get_size()
-            screen_aspect_ratio = screen_w / screen_h
-            photo_aspect_ratio = image_w / image_h
-
-            if self._scale:
-                if screen_aspect_ratio < photo_aspect_ratio:  # Width is binding
-                    new_image_w = screen_w
-                    new_image_h = int(new_image_w / photo_aspect_ratio)
-                    pyimage = pygame.transform.scale(pyimage, (new_image_w, new_image_h))
-                elif screen_aspect_ratio > photo_aspect_ratio:  # Height is binding
-                    new_image_h = screen_h
-                    new_image_w = int(new_image_h * photo_aspect_ratio)
-                    pyimage = pygame.transform.scale(pyimage, (new_image_w, new_image_h))
-                else:  # Images have the same aspect ratio
-                    pyimage = pygame.transform.scale(pyimage, (screen_w, screen_h))
-
-            if self._center:
-                if screen_aspect_ratio < photo_aspect_ratio:
-                    image_y = (screen_h - new_image_h) // 2
-                elif screen_aspect_ratio > photo_aspect_ratio:
-                    image_x = (screen_w - new_image_w) // 2
-
-            self._screen.blit(pyimage, (image_x, image_y))
-            pygame.display.flip()
-            #future todo: crossfade, ken burns possbile?
-            #future todo: maybe preload images and/or create pygame image dict
+            pyimage, position, frames = self._cache.get(imagepath)
+            if frames:
+                # Animations are shown as they are, without transitions.
+                self._transition.stop()
+                self._frames = frames
+                self._frame_index = 0
+                self._frame_position = position
+                self._frame_due = monotonic() + frames[0][1]
+                self._blank_screen(False)
+                self._screen.blit(pyimage, position)
+                pygame.display.flip()
+            elif self._transition.enabled:
+                duration = self._duration*self._loop if self._loop > 0 else None
+                self._transition.start(pyimage, position, duration)
+            else:
+                self._blank_screen(False)
+                self._screen.blit(pyimage, position)
+                pygame.display.flip()
 
         self._startTime = monotonic()
+        self._ended = False
+
+    def _load_image(self, imagepath):
+        """Load an image, scale it to the screen and convert it to the display
+        format.  Returns the surface, the position to blit it at and for
+        animated images the list of [frame, delay].
+        """
+        rendition = self._renditions.lookup(imagepath) if self._renditions else None
+        if rendition is not None:
+            # Already fitted to the screen, only the position is needed.
+            # Animations have no renditions, the original isn't opened.
+            pyimage = pygame.image.load(rendition)
+            size, position = fit_image(pyimage.get_size(), self._size, False, self._center)
+            return self._convert(pyimage), position, None
+
+        # Leave room in the cache for more than one animation.
+        frames = load_frames(imagepath, self._size, self._scale,
+                             max(1, self._cache_size * 1024 * 1024 // 2))
+        if frames:
+            for frame in frames:
+                frame[0] = self._convert(frame[0])
+            size, position = fit_image(frames[0][0].get_size(), self._size, False, self._center)
+            return frames[0][0], position, frames
+
+        pyimage = load_image(imagepath, self._size, self._scale)
+        size, position = fit_image(pyimage.get_size(), self._size, self._scale, self._center)
+        if size != pyimage.get_size():
+            pyimage = pygame.transform.scale(pyimage, size)
+
+        return self._convert(pyimage), position, None
+
+    def _convert(self, pyimage):
+        # Blitting is a plain copy once the pixel format matches the screen.
+        if pyimage.get_flags() & pygame.SRCALPHA:
+            return pyimage.convert_alpha()
+        return pyimage.convert()
+
+    def _animate(self):
+        """Show the next frame of an animated image when it is due."""
+        if self._frames is None or self._isPaused:
+            return
+        now = monotonic()
+        if now < self._frame_due:
+            return
+        # Skip frames that are late already, the animation keeps its pace.
+        while self._frame_due <= now:
+            self._frame_index = (self._frame_index + 1) % len(self._frames)
+            self._frame_due += self._frames[self._frame_index][1]
+        frame = self._frames[self._frame_index][0]
+        rect = frame.get_rect(topleft=self._frame_position)
+        if frame.get_flags() & pygame.SRCALPHA:
+            self._screen.set_clip(rect)
+            self._draw_background(self._screen)
+            self._screen.set_clip(None)
+        self._screen.blit(frame, rect)
+        pygame.display.update(rect)
+
+    def prepare_playlist(self, movies):
+        """Render the images of a new playlist to the disk cache."""
+        if self._renditions:
+            self._renditions.prepare(movie.target for movie in movies)
+
+    def preload(self, peek):
+        """Load the next images in the background while this one is shown."""
+        if self._preload_count > 0:
+            self._cache.prefetch(movie.target for movie in peek(self._preload_count))
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats.update(self._transition.stats())
+        return stats
 
     def pause(self):
         self._isPaused = not self._isPaused
+        self._transition.pause(self._isPaused)
+        if self._frames is not None:
+            if self._isPaused:
+                self._frame_due -= monotonic()
+            else:
+                self._frame_due += monotonic()
     
     def sendKey(self, key: str):
         print("sendKey not available for image_player")
 
+    def update(self):
+        """Draw the next transition or animation frame and clear the screen
+        once the image was shown long enough.  Called by the main loop only.
+        """
+        self._transition.tick()
+        self._animate()
+        if not self._ended and not self.is_playing():
+            self._ended = True
+            self._frames = None
+            if self._wait_time > 0: #only refresh background if we wait between images
+                self._blank_screen()
+
     def is_playing(self):
         """Here we need to compare for how long the image was displayed"""
         if self._loop <= -1 or self._isPaused: #loop one image = play forever
             return True
         
-        playing = (monotonic() - self._startTime) < self._duration*self._loop
-        
-        if not playing and self._wait_time > 0: #only refresh background if we wait between images
-            self._blank_screen()
-        
-        return playing
+        return (monotonic() - self._startTime) < self._duration*self._loop
+
+    def next_timeout(self):
+        """Return the seconds until the image has been shown long enough, or
+        None if it is shown until stopped (or not shown at all).  While a
+        transition runs it is the time until its next frame.
+        """
+        frame = self._transition.next_timeout()
+        if self._frames is not None and not self._isPaused:
+            frame = max(0, self._frame_due - monotonic())
+        if self._loop <= -1 or self._isPaused:
+            return frame
+        remaining = self._startTime + self._duration*self._loop - monotonic()
+        if remaining <= 0:
+            return frame
+        return remaining if frame is None else min(frame, remaining)
 
     def stop(self, block_timeout_sec=0):
         """Stop the image display."""
+        self._transition.stop()
+        self._frames = None
+        self._ended = True
         self._blank_screen()
         self._startTime = self._startTime-self._duration*self._loop
 
+    def close(self):
+        """Cancel the images waiting to be rendered to the disk cache, so
+        exiting doesn't wait for them.
+        """
+        if self._renditions:
+            self._renditions.close()
+
+    def _draw_background(self, surface):
+        """Fill a surface with the background color and optional the background image."""
+        surface.fill(self._bgcolor)
+        if self._bgimage[0] is not None:
+            surface.blit(self._bgimage[0], (self._bgimage[1], self._bgimage[2]))
+
     def _blank_screen(self, flip=True):
         """Render a blank screen filled with the background color and optional the background image."""
-        self._screen.fill(self._bgcolor)
-        if self._bgimage[0] is not None:
-            self._screen.blit(self._bgimage[0], (self._bgimage[1], self._bgimage[2]))
+        self._draw_background(self._screen)
         if(flip):
             pygame.display.flip()
 
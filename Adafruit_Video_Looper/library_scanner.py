@@ -0,0 +1,152 @@
+# License: GNU GPLv2, see LICENSE.txt
+import fnmatch
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .media_index import MediaEntry
+
+
+class ScanStats:
+    """Counters of a library scan."""
+
+    def __init__(self):
+        self.roots = 0
+        self.directories = 0
+        self.excluded = 0
+        self.media = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return ('scanned {0} director{1} in {2} path{3}, found {4} media file{5} '
+                '({6} excluded, {7} errors) in {8:.3f}s').format(
+                    self.directories, 'y' if self.directories == 1 else 'ies',
+                    self.roots, '' if self.roots == 1 else 's',
+                    self.media, '' if self.media == 1 else 's',
+                    self.excluded, self.errors, self.seconds)
+
+
+class LibraryScanner:
+    """Finds media files below a set of root paths.
+
+    Each root path (e.g. every mounted USB drive) is walked in its own worker
+    thread with os.scandir, down to max_depth levels of subdirectories (0 only
+    scans the root itself, -1 has no limit).  Names or paths relative to the
+    root matching one of the exclude globs are skipped.  Results are streamed
+    as they are found and, if a MediaIndex is given, unchanged directories are
+    taken from the index without listing them.
+    """
+
+    def __init__(self, parse, parser_key, max_depth=0, exclude=(), workers=4, media_index=None):
+        """parse(name) returns (title, repeats) for media files and None for
+        everything else, parser_key identifies the parse configuration for
+        the media index.
+        """
+        self._parse = parse
+        self._parser_key = parser_key
+        self._max_depth = max_depth
+        self._workers = max(1, workers)
+        self._media_index = media_index
+        patterns = [pattern.strip() for pattern in exclude if pattern.strip()]
+        if patterns:
+            self._exclude = re.compile('|'.join(fnmatch.translate(p) for p in patterns),
+                                       flags=re.IGNORECASE)
+        else:
+            self._exclude = None
+        self.stats = ScanStats()
+
+    def _is_excluded(self, name, relpath):
+        return self._exclude is not None and (self._exclude.match(name) is not None or
+                                              self._exclude.match(relpath) is not None)
+
+    def _list_directory(self, path):
+        """Return (entries, subdirectory names) of a single directory."""
+        if self._media_index is not None:
+            try:
+                return self._media_index.scan(path, self._parser_key, self._parse)
+            except sqlite3.Error:
+                # A broken index must not prevent playback, list directly.
+                pass
+        entries = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                name = dir_entry.name
+                if name.startswith('.'):
+                    continue
+                if dir_entry.is_dir(follow_symlinks=False):
+                    subdirs.append(name)
+                    continue
+                parsed = self._parse(name)
+                if parsed is not None:
+                    entries.append(MediaEntry(dir_entry.path, name, None, None,
+                                              parsed[0], int(parsed[1])))
+        return entries, subdirs
+
+    def _walk(self, root, results, stats_lock):
+        directories = [(root, '', 0)]
+        while directories:
+            path, relpath, depth = directories.pop()
+            try:
+                entries, subdirs = self._list_directory(path)
+            except OSError:
+                with stats_lock:
+                    self.stats.errors += 1
+                continue
+            found = []
+            excluded = 0
+            for entry in entries:
+                if self._is_excluded(entry.name, os.path.join(relpath, entry.name)):
+                    excluded += 1
+                else:
+                    found.append(entry)
+            if self._max_depth < 0 or depth < self._max_depth:
+                for name in subdirs:
+                    sub_relpath = os.path.join(relpath, name)
+                    if self._is_excluded(name, sub_relpath):
+                        excluded += 1
+                    else:
+                        directories.append((os.path.join(path, name), sub_relpath, depth + 1))
+            with stats_lock:
+                self.stats.directories += 1
+                self.stats.excluded += excluded
+                self.stats.media += len(found)
+            if found:
+                results.put(found)
+
+    def scan(self, roots):
+        """Generator yielding a MediaEntry for every media file below the
+        root paths, in no particular order.  Statistics of the scan are
+        available in the stats attribute once the generator is exhausted.
+        """
+        roots = [root for root in roots if os.path.isdir(root)]
+        self.stats = ScanStats()
+        self.stats.roots = len(roots)
+        if not roots:
+            return
+        if self._media_index is not None:
+            self._media_index.reset_locations()
+        start = time.monotonic()
+        results = queue.Queue()
+        stats_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=min(self._workers, len(roots))) as pool:
+            futures = [pool.submit(self._walk, root, results, stats_lock) for root in roots]
+            for future in futures:
+                future.add_done_callback(lambda f: results.put(None))
+            remaining = len(futures)
+            while remaining:
+                batch = results.get()
+                if batch is None:
+                    remaining -= 1
+                    continue
+                for entry in batch:
+                    yield entry
+            for future in futures:
+                # Re-raise unexpected errors of the workers.
+                future.result()
+        self.stats.seconds = time.monotonic() - start
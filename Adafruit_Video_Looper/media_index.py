@@ -0,0 +1,208 @@
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import os
+import re
+import sqlite3
+import threading
+
+# Filesystems whose directory mtime is not reliably updated when files are
+# added or removed (e.g. FAT written by Windows), their listings are always
+# re-read and only the per-file work is taken from the index.
+UNTRUSTED_DIR_MTIME_FS = ('vfat', 'msdos', 'exfat', 'fuseblk', 'ntfs', 'ntfs3')
+
+# Bump when the schema changes, the index is a cache and simply gets rebuilt.
+SCHEMA_VERSION = 3
+
+MediaEntry = collections.namedtuple('MediaEntry', 'path name size mtime_ns title repeats')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    source TEXT NOT NULL,
+    relpath TEXT NOT NULL,
+    parser_key TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL,
+    PRIMARY KEY (source, relpath)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    source TEXT NOT NULL,
+    relpath TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    title TEXT,
+    repeats INTEGER NOT NULL,
+    PRIMARY KEY (source, relpath, name)
+);
+"""
+
+
+def _read_mounts():
+    """Return a list of (mount_point, fs_type, source) from mountinfo."""
+    mounts = []
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                fields = line.split()
+                separator = fields.index('-')
+                mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[4])
+                mounts.append((mount_point, fields[separator + 1], fields[separator + 2]))
+    except (OSError, ValueError, IndexError):
+        pass
+    return mounts
+
+
+def _read_uuids():
+    """Return a dict of device number -> filesystem UUID and device path ->
+    filesystem UUID from /dev/disk/by-uuid.
+    """
+    by_rdev = {}
+    by_path = {}
+    base = '/dev/disk/by-uuid'
+    try:
+        names = os.listdir(base)
+    except OSError:
+        return by_rdev, by_path
+    for name in names:
+        link = os.path.join(base, name)
+        try:
+            by_rdev[os.stat(link).st_rdev] = name
+            by_path[os.path.realpath(link)] = name
+        except OSError:
+            continue
+    return by_rdev, by_path
+
+
+def locate_mount(path):
+    """Identify the filesystem path lives on.  Returns a tuple of
+    (source_id, mount point, filesystem type).  The source id is the filesystem
+    UUID if it can be found, otherwise the device and inode of the mount point,
+    so the same USB stick is recognized no matter where it gets mounted.
+    """
+    path = os.path.realpath(path)
+    mount_point, fs_type, device = '/', '', ''
+    for mp, fs, source in _read_mounts():
+        if (path == mp or path.startswith(mp.rstrip('/') + '/')) and len(mp) >= len(mount_point):
+            mount_point, fs_type, device = mp, fs, source
+    by_rdev, by_path = _read_uuids()
+    st_dev = os.stat(path).st_dev
+    uuid = by_rdev.get(st_dev) or by_path.get(os.path.realpath(device) if device else None)
+    if uuid:
+        source = 'uuid:' + uuid
+    else:
+        st = os.stat(mount_point)
+        source = 'dev:{0}:{1}'.format(st.st_dev, st.st_ino)
+    return source, mount_point, fs_type
+
+
+class MediaIndex:
+    """Persistent index of the media files found in the searched directories.
+
+    Directories are keyed by their filesystem (see locate_mount) and path inside of
+    it, entries by name with their size and mtime.  If a directory did not
+    change since the last scan its entries are returned without listing it.
+    """
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            with self._db:
+                # small_files is left over from version 2
+                for table in ('directories', 'entries', 'small_files'):
+                    self._db.execute('DROP TABLE IF EXISTS ' + table)
+        self._db.executescript(_SCHEMA)
+        self._db.execute('PRAGMA user_version={0}'.format(SCHEMA_VERSION))
+        self._locations = {}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def reset_locations(self):
+        """Forget which filesystems are mounted where, call before each scan
+        as drives might have been swapped in the meantime.
+        """
+        self._locations = {}
+
+    def _locate(self, path):
+        """Return (source_id, relative path, filesystem type) for path."""
+        path = os.path.realpath(path)
+        st_dev = os.stat(path).st_dev
+        if st_dev not in self._locations:
+            self._locations[st_dev] = locate_mount(path)
+        source, mount_point, fs_type = self._locations[st_dev]
+        return source, os.path.relpath(path, mount_point), fs_type
+
+    def scan(self, path, parser_key, parse):
+        """Scan a single directory.  Returns a tuple of a list of MediaEntry for
+        the media files in path and a list of the names of its subdirectories.
+
+        parse(name) returns (title, repeats) for media files and None for
+        everything else, parser_key identifies its configuration (e.g. the
+        allowed extensions) so a changed configuration invalidates the index.
+        Hidden files and directories (starting with a dot) are ignored.
+        """
+        source, relpath, fs_type = self._locate(path)
+        dir_mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            row = self._db.execute(
+                'SELECT parser_key, mtime_ns, subdirs FROM directories WHERE source=? AND relpath=?',
+                (source, relpath)).fetchone()
+            cached = {}
+            if row is not None and row[0] == parser_key:
+                for name, size, mtime_ns, title, repeats in self._db.execute(
+                        'SELECT name, size, mtime_ns, title, repeats FROM entries '
+                        'WHERE source=? AND relpath=?', (source, relpath)):
+                    cached[name] = MediaEntry(os.path.join(path, name), name, size,
+                                              mtime_ns, title, repeats)
+                if row[1] == dir_mtime and fs_type not in UNTRUSTED_DIR_MTIME_FS:
+                    return list(cached.values()), [d for d in row[2].split('\n') if d]
+
+        # Directory changed (or can't be trusted): list it again, but only
+        # files that are new or whose size/mtime changed are parsed again.
+        entries = []
+        subdirs = []
+        changed = row is None or row[0] != parser_key or row[1] != dir_mtime
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                name = dir_entry.name
+                if name.startswith('.'):
+                    continue
+                try:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        subdirs.append(name)
+                        continue
+                    entry = cached.get(name)
+                    if entry is None:
+                        parsed = parse(name)
+                        if parsed is None:
+                            continue
+                    st = dir_entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry is None or (entry.size, entry.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                    title, repeats = parsed if entry is None else (entry.title, entry.repeats)
+                    entry = MediaEntry(dir_entry.path, name, st.st_size,
+                                       st.st_mtime_ns, title, int(repeats))
+                    changed = True
+                entries.append(entry)
+        subdirs.sort()
+        changed = (changed or len(entries) != len(cached) or
+                   row is None or row[2] != '\n'.join(subdirs))
+
+        if changed:
+            with self._lock, self._db:
+                self._db.execute('DELETE FROM entries WHERE source=? AND relpath=?',
+                                 (source, relpath))
+                self._db.executemany(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(source, relpath, e.name, e.size, e.mtime_ns, e.title, e.repeats)
+                     for e in entries])
+                self._db.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)',
+                                 (source, relpath, parser_key, dir_mtime, '\n'.join(subdirs)))
+        return entries, subdirs
@@ -1,22 +1,47 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
+import hashlib
 import random
 from os.path import basename
 from typing import Optional, Union
 
 random.seed()
 
+# Shared by movies that are in no playlist, their play counts are never reset
+# all at once.
+_NO_GENERATION = [0]
+
 class Movie:
     """Representation of a movie"""
 
+    # Playlists can have tens of thousands of movies, no dict per instance.
+    __slots__ = ('target', 'filename', 'title', 'repeats', '_playcount', '_counted',
+                 '_generation')
+
     def __init__(self, target:str , title: Optional[str] = None, repeats: int = 1):
         """Create a playlist from the provided list of movies."""
         self.target = target
         self.filename = basename(target)
         self.title = title
         self.repeats = int(repeats)
-        self.playcount = 0
+        self._playcount = 0
+        # The play count is only valid while the generation of the playlist
+        # (a one element list it shares with its movies) is the one it was
+        # counted in, so the playlist can reset all counts in O(1).
+        self._counted = 0
+        self._generation = _NO_GENERATION
+
+    @property
+    def playcount(self):
+        if self._counted != self._generation[0]:
+            return 0
+        return self._playcount
+
+    @playcount.setter
+    def playcount(self, value):
+        self._playcount = value
+        self._counted = self._generation[0]
 
     def was_played(self):
         if self.repeats > 1:
@@ -48,13 +73,127 @@ class Movie:
         return repr((self.target, self.filename, self.title, self.repeats, self.playcount))
 
 class Playlist:
-    """Representation of a playlist of movies."""
+    """Representation of a playlist of movies.
+
+    Movies are indexed by file name and path, so jumping to a movie and
+    resetting the play counts take the same time for any playlist size.
+
+    Random order is a shuffle bag: every movie plays once per cycle in an
+    order drawn when the cycle starts, so peek() can tell what plays next
+    and the order can be saved for resume_playlist.
+    """
 
     def __init__(self, movies):
         """Create a playlist from the provided list of movies."""
-        self._movies = movies
+        self._movies = []
+        self._by_filename = {}
+        self._by_target = {}
+        self._generation = [0]
         self._index = None
+        # index of the movie set with set_next
         self._next = None
+        # (seed, avoided first index, order) of the current and the already
+        # drawn following shuffle bag, seed is None once movies were added
+        self._bag = None
+        self._bag_position = None
+        self._next_bag = None
+        self._identity = None
+        self._state = None
+        self._state_key = None
+        for movie in movies:
+            self.add(movie)
+
+    @property
+    def movies(self):
+        """The movies of the playlist, in playlist order."""
+        return self._movies
+
+    @property
+    def identity(self):
+        """Short hash of the movie paths, tells if a saved index still
+        refers to the same playlist.
+        """
+        if self._identity is None:
+            paths = '\n'.join(movie.target for movie in self._movies)
+            self._identity = hashlib.sha1(paths.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+        return self._identity
+
+    def attach_state(self, store, key):
+        """Keep the position in the playlist in store (a StateStore) under
+        key, get_next(resume=True) continues from there after a restart.
+        """
+        self._state = store
+        self._state_key = key
+
+    def _resume_index(self):
+        """Return the saved index if it is for this playlist, otherwise the
+        index of the saved movie or 0.
+        """
+        saved = self._state.get(self._state_key) if self._state is not None else None
+        if not isinstance(saved, dict):
+            return 0
+        index = saved.get('index')
+        if saved.get('playlist') == self.identity and isinstance(index, int) \
+                and 0 <= index < self.length():
+            return index
+        return self._by_target.get(saved.get('movie'), 0)
+
+    def _draw_bag(self, avoid, seed=None):
+        """Return a new shuffle bag that doesn't start with index avoid (the
+        movie that played last), the same one again for the same seed.
+        """
+        if seed is None:
+            seed = random.getrandbits(32)
+        order = list(range(self.length()))
+        random.Random(seed).shuffle(order)
+        if len(order) > 1 and order[0] == avoid:
+            order[0], order[-1] = order[-1], order[0]
+        return seed, avoid, order
+
+    def _restore_bag(self):
+        """Continue the saved shuffle bag, returns if there was one for
+        this playlist.
+        """
+        saved = self._state.get(self._state_key) if self._state is not None else None
+        if not isinstance(saved, dict) or saved.get('playlist') != self.identity:
+            return False
+        try:
+            seed, avoid = saved['shuffle']
+            position = int(saved['shuffle_position'])
+            bag = self._draw_bag(avoid, seed)
+            if self._movies[bag[2][position]].target != saved.get('movie'):
+                return False
+        except (KeyError, TypeError, ValueError, IndexError):
+            return False
+        self._bag = bag
+        self._bag_position = position
+        self._next_bag = None
+        return True
+
+    def _random_index(self, resume):
+        """Return the next index of the shuffle bag, a new bag is used after
+        the last one.
+        """
+        if self._index is None and resume and self._restore_bag():
+            return self._bag[2][self._bag_position]
+        if self._bag is None:
+            self._bag = self._draw_bag(self._index)
+            self._bag_position = 0
+        elif self._bag_position + 1 >= len(self._bag[2]):
+            self._bag = self._next_bag or self._draw_bag(self._bag[2][-1])
+            self._bag_position = 0
+            self._next_bag = None
+        else:
+            self._bag_position += 1
+        return self._bag[2][self._bag_position]
+
+    def index_of(self, thing: Union[Movie, str]) -> Optional[int]:
+        """Return the index of a movie (matched by path) or of the first
+        movie with a file name, None if it is not in the playlist.
+        """
+        if isinstance(thing, Movie):
+            return self._by_target.get(thing.target)
+        return self._by_filename.get(thing)
 
     def get_next(self, is_random, resume = False) -> Movie:
         """Get the next movie in the playlist. Will loop to start of playlist
@@ -66,25 +205,15 @@ class Playlist:
         
         # Check if next movie is set and jump directly there:
         if self._next is not None:
-            next=self._next
+            self._index = self._next
             self._next = None # reset next
-            self._index=self._movies.index(next)
-            return next
-        
-        # Start Random movie
-        if is_random:
-            self._index = random.randrange(0, self.length())
+        # Continue the shuffled order
+        elif is_random:
+            self._index = self._random_index(resume)
         else:
             # Start at the first movie or resume and increment through them in order.
             if self._index is None:
-                if resume:
-                    try:
-                        with open('playlist_index.txt', 'r') as f:
-                            self._index = int(f.read())
-                    except FileNotFoundError:
-                        self._index = 0
-                else:
-                    self._index = 0
+                self._index = self._resume_index() if resume else 0
             else:
                 self._index += 1
                 
@@ -92,38 +221,111 @@ class Playlist:
             if self._index >= self.length():
                 self._index = 0
 
-        if resume:
-            with open('playlist_index.txt','w') as f:
-                f.write(str(self._index))
+        if resume and self._state is not None:
+            state = {'playlist': self.identity, 'index': self._index,
+                     'movie': self._movies[self._index].target, 'position': 0}
+            if is_random and self._bag is not None and self._bag[0] is not None \
+                    and self._bag[2][self._bag_position] == self._index:
+                state['shuffle'] = list(self._bag[:2])
+                state['shuffle_position'] = self._bag_position
+            self._state.set(self._state_key, state)
 
         return self._movies[self._index]
     
+    def peek(self, count=1, is_random=False):
+        """Return up to count movies get_next will most likely return next,
+        without changing the playlist position.  In random order the shuffle
+        bag (and the following one) is drawn now if it wasn't yet.
+        """
+        if self.length() == 0:
+            return []
+        upcoming = []
+        if is_random:
+            if self._next is not None:
+                upcoming.append(self._movies[self._next])
+            if self._bag is None:
+                self._bag = self._draw_bag(self._index)
+                self._bag_position = -1
+            order = self._bag[2][self._bag_position + 1:self._bag_position + 1 + count]
+            if len(upcoming) + len(order) < count:
+                if self._next_bag is None:
+                    self._next_bag = self._draw_bag(self._bag[2][-1])
+                order += self._next_bag[2]
+            upcoming.extend(self._movies[index] for index in order)
+            return upcoming[:count]
+        index = -1 if self._index is None else self._index
+        if self._next is not None:
+            upcoming.append(self._movies[self._next])
+            index = self._next
+        while len(upcoming) < count:
+            index = (index + 1) % self.length()
+            upcoming.append(self._movies[index])
+        return upcoming
+
     # sets next by filename or Movie object or index
     def set_next(self, thing: Union[Movie, str, int]):
-        if isinstance(thing, Movie):
-            if (thing in self._movies):
-                self._next(thing)
-        elif isinstance(thing, str):
-            if thing in self._movies:
-                self._next = self._movies[self._movies.index(thing)]
-            elif thing[0:1] in ("+","-"):
-                self._next = self._movies[(self._index+int(thing))%self.length()]
-        elif isinstance(thing, int):
-            if thing >= 0 and thing <= self.length():
-                self._next = self._movies[thing]
+        if self.length() == 0:
+            return
+        if isinstance(thing, (Movie, str)) and self.index_of(thing) is not None:
+            self._next = self.index_of(thing)
+        elif isinstance(thing, str) and thing[0:1] in ("+","-"):
+            self._next = (self._current() + int(thing)) % self.length()
+        elif isinstance(thing, int) and 0 <= thing < self.length():
+            self._next = thing
         else:
             self._next = None
         self.clear_all_playcounts()
-        self._movies[self._index].finish_playing() #set the current to max playcount so it will not get played again
+        if self._index is not None:
+            self._movies[self._index].finish_playing() #set the current to max playcount so it will not get played again
        
     # sets next relative to current index
     def seek(self, amount:int):
-        self.set_next((self._index+amount)%self.length())
+        if self.length():
+            self.set_next((self._current() + amount) % self.length())
+
+    def _current(self):
+        # Before the first movie seeking forward by one starts with the first.
+        return -1 if self._index is None else self._index
+
+    def add(self, movie: Movie):
+        """Append a movie, e.g. one that just became available."""
+        index = len(self._movies)
+        self._movies.append(movie)
+        self._by_filename.setdefault(movie.filename, index)
+        self._by_target.setdefault(movie.target, index)
+        movie._generation = self._generation
+        self._identity = None
+        if self._bag is not None:
+            # Plays in the rest of the current cycle.
+            _, avoid, order = self._bag
+            order.insert(random.randint(self._bag_position + 1, len(order)), index)
+            self._bag = None, avoid, order
+            self._next_bag = None
+
+    def update(self, movies):
+        """Replace the movies of the playlist without starting over: if the
+        current movie is still in it (by file name), get_next continues after
+        it.
+        """
+        current = None
+        if self._index is not None and self._index < self.length():
+            current = self._movies[self._index].filename
+        following = None if self._next is None else self._movies[self._next].filename
+        self._movies = []
+        self._by_filename = {}
+        self._by_target = {}
+        self._bag = None
+        self._bag_position = None
+        self._next_bag = None
+        for movie in movies:
+            self.add(movie)
+        self._index = self._by_filename.get(current)
+        self._next = self._by_filename.get(following)
 
     def length(self):
         """Return the number of movies in the playlist."""
         return len(self._movies)
 
     def clear_all_playcounts(self):
-        for movie in self._movies:
-            movie.clear_playcount()
\ No newline at end of file
+        # Counts from an older generation read as 0.
+        self._generation[0] += 1
@@ -0,0 +1,332 @@
+# License: GNU GPLv2, see LICENSE.txt
+import atexit
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from .alsa_config import parse_hw_device
+from .process_manager import PlayerProcess
+
+# How long to wait for a freshly started mpv to open its IPC socket.
+STARTUP_TIMEOUT_SEC = 10
+
+# request_id of the time-pos queries, their replies update the position.
+_POSITION_REQUEST = 1
+
+
+class MPVPlayer:
+
+    def __init__(self, config):
+        """Create an instance of a video player that keeps a single mpv
+        process running in idle mode and controls it over its JSON IPC socket.
+        The next movie is appended to mpv's playlist while the current one
+        plays, so mpv switches to it without a gap.
+        """
+        self._process = None
+        self._socket = None
+        self._buffer = b''
+        self._temp_directory = tempfile.mkdtemp()
+        self._socket_path = os.path.join(self._temp_directory, 'mpv.sock')
+        # State of the current item: _playing is true from play() until mpv
+        # reports the end of the file.
+        self._playing = False
+        # (key, loop) of the movie appended to mpv's playlist by preload().
+        self._preloaded = None
+        # True if mpv already switched to the preloaded movie on its own.
+        self._advanced = False
+        self._volume = None
+        # Playback position of the current movie as last reported by mpv and
+        # a seek waiting for the movie to be loaded.
+        self._position = None
+        self._pending_seek = None
+        self._loaded = False
+        self._ended_at = None
+        self._last_transition = None
+        # is_playing() is also called from the keyboard and GPIO threads,
+        # reading from and writing to the socket is serialized.
+        self._lock = threading.RLock()
+        self._load_config(config)
+        atexit.register(self._shutdown)
+
+    def __del__(self):
+        if self._temp_directory:
+            shutil.rmtree(self._temp_directory, ignore_errors=True)
+
+    def _load_config(self, config):
+        self._extensions = config.get('mpv', 'extensions') \
+                                 .translate(str.maketrans('', '', ' \t\r\n.')) \
+                                 .split(',')
+        self._extra_args = config.get('mpv', 'extra_args').split()
+        self._alsa_hw_device = parse_hw_device(config.get('alsa', 'hw_device'))
+        self._show_titles = config.getboolean('mpv', 'show_titles')
+        self._title_duration = config.getint('mpv', 'title_duration')
+        # The looper shows a wait screen between movies.
+        self._wait_time = config.getint('video_looper', 'wait_time')
+
+    def supported_extensions(self):
+        """Return list of supported file extensions."""
+        return self._extensions
+
+    def _start(self):
+        """Start mpv in idle mode and connect to its IPC socket."""
+        self._close_socket()
+        if self._process is not None:
+            self._process.stop(3)
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+        args = ['mpv', '--idle=yes', '--no-terminal', '--keep-open=no',
+                '--gapless-audio=yes', '--prefetch-playlist=yes',
+                '--input-ipc-server={0}'.format(self._socket_path)]
+        if self._alsa_hw_device is not None:
+            args.append('--audio-device=alsa/hw:{0},{1}'.format(*self._alsa_hw_device))
+        args.extend(self._extra_args)
+        self._process = PlayerProcess(args)
+        deadline = time.monotonic() + STARTUP_TIMEOUT_SEC
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self._socket_path)
+                break
+            except OSError:
+                sock.close()
+                if self._process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('mpv did not start, is it installed?')
+                time.sleep(0.05)
+        sock.setblocking(False)
+        self._socket = sock
+        self._buffer = b''
+        self._playing = False
+        self._preloaded = None
+        self._advanced = False
+        self._volume = None
+
+    def _close_socket(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _ensure_running(self):
+        if self._process is None or self._process.poll() is not None or self._socket is None:
+            self._start()
+
+    def _command(self, *args, request_id=None):
+        """Send a command to mpv, replies are not waited for."""
+        with self._lock:
+            self._send(args, request_id)
+
+    def _send(self, args, request_id):
+        if self._socket is None:
+            return
+        message = {'command': list(args)}
+        if request_id is not None:
+            message['request_id'] = request_id
+        data = (json.dumps(message) + '\n').encode()
+        try:
+            self._socket.setblocking(True)
+            self._socket.sendall(data)
+        except OSError:
+            self._close_socket()
+        finally:
+            if self._socket is not None:
+                self._socket.setblocking(False)
+
+    def _process_events(self):
+        """Read everything mpv sent and update the playback state."""
+        with self._lock:
+            self._read_events()
+
+    def _read_events(self):
+        if self._socket is None:
+            return
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b''
+            if not data:
+                # mpv went away.
+                self._close_socket()
+                self._playing = False
+                break
+            self._buffer += data
+        lines = self._buffer.split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            try:
+                message = json.loads(line.decode())
+            except ValueError:
+                continue
+            event = message.get('event')
+            if message.get('request_id') == _POSITION_REQUEST:
+                if message.get('error') == 'success' and isinstance(message.get('data'), (int, float)):
+                    self._position = message['data']
+            elif event == 'file-loaded':
+                self._loaded = True
+                if self._pending_seek is not None:
+                    self._command('seek', self._pending_seek, 'absolute')
+                    self._pending_seek = None
+            elif event == 'end-file' and message.get('reason') in ('eof', 'error'):
+                # The current movie is done.  If one was appended mpv starts
+                # it right away, play() then only has to acknowledge it.
+                self._playing = False
+                self._ended_at = time.monotonic()
+                self._advanced = self._preloaded is not None
+            elif event == 'start-file':
+                self._loaded = False
+                self._position = None
+            if event == 'start-file' and self._advanced and self._preloaded is not None:
+                self._set_loop(self._preloaded[1])
+                if self._ended_at is not None:
+                    self._last_transition = time.monotonic() - self._ended_at
+
+    def _movie_key(self, movie, loop):
+        if loop is None:
+            loop = movie.repeats
+        return (movie.target, loop)
+
+    def _set_loop(self, loop):
+        if loop <= -1:
+            self._command('set_property', 'loop-file', 'inf')
+        elif loop > 1:
+            # loop-file counts the additional runs.
+            self._command('set_property', 'loop-file', str(loop - 1))
+        else:
+            self._command('set_property', 'loop-file', 'no')
+
+    def _set_volume(self, vol):
+        """Set the volume given in millibels like omxplayer's --vol."""
+        if vol == self._volume:
+            return
+        self._volume = vol
+        # mpv's volume scale is cubic, 100 means unchanged.
+        gain = 10 ** (vol / 2000.0)
+        self._command('set_property', 'volume', round(100 * gain ** (1 / 3.0), 1))
+
+    def play(self, movie, loop=None, vol=0):
+        """Play the provided movie file, optionally looping it repeatedly."""
+        self._ensure_running()
+        self._process_events()
+        if loop is None:
+            loop = movie.repeats
+        key = self._movie_key(movie, loop)
+        if self._advanced and self._preloaded is not None and self._preloaded[0] == key:
+            # mpv already switched to this movie gaplessly, drop the finished
+            # entry from its playlist.
+            self._command('playlist-clear')
+        else:
+            self._set_loop(loop)
+            self._command('loadfile', movie.target, 'replace')
+            self._loaded = False
+            self._position = None
+            if self._ended_at is not None:
+                self._last_transition = time.monotonic() - self._ended_at
+        self._set_volume(vol)
+        if self._show_titles and movie.title:
+            duration = self._title_duration * 1000 if self._title_duration >= 0 else 2**31 - 1
+            self._command('show-text', movie.title, duration, 0)
+        self._preloaded = None
+        self._advanced = False
+        self._ended_at = None
+        self._pending_seek = None
+        self._playing = True
+
+    def preload(self, peek):
+        """Append the next movie to mpv's playlist so it starts gaplessly.
+        peek(n) returns the upcoming movies.  Not done if the looper waits
+        between movies, mpv would start the appended one during the wait.
+        """
+        if self._socket is None or self._wait_time > 0:
+            return
+        upcoming = peek(1)
+        key = self._movie_key(upcoming[0], None) if upcoming else None
+        if self._preloaded is not None and self._preloaded[0] == key:
+            return
+        # Remove an outdated prediction, keeps the playing file.
+        self._command('playlist-clear')
+        self._preloaded = None
+        if key is not None:
+            self._command('loadfile', key[0], 'append')
+            self._preloaded = (key, key[1])
+
+    def pause(self):
+        self._command('cycle', 'pause')
+
+    def seek(self, seconds, relative=False):
+        """Seek to a position (in seconds) in the playing movie.  Absolute
+        seeks right after play() are done once mpv loaded the movie.
+        """
+        self._process_events()
+        if not relative and not self._loaded:
+            self._pending_seek = seconds
+            return
+        self._command('seek', seconds, 'relative' if relative else 'absolute')
+
+    def position(self):
+        """Return the playback position in seconds of the current movie,
+        None if it isn't known yet.  The value is from the previous call (mpv
+        answers asynchronously), call it regularly.
+        """
+        self._process_events()
+        if not self._playing:
+            return None
+        self._command('get_property', 'time-pos', request_id=_POSITION_REQUEST)
+        return self._position
+
+    def sendKey(self, key: str):
+        # Chapter keys as used with omxplayer, everything else is passed on
+        # to mpv's key bindings.
+        if key == 'o':
+            self._command('add', 'chapter', 1)
+        elif key == 'i':
+            self._command('add', 'chapter', -1)
+        else:
+            self._command('keypress', key)
+
+    def is_playing(self):
+        """Return true if a movie is playing, false otherwise."""
+        self._process_events()
+        if self._process is None or self._process.poll() is not None:
+            return False
+        return self._playing
+
+    def fileno(self):
+        """Return the IPC socket, readable when mpv sent events."""
+        if self._socket is None:
+            return None
+        return self._socket.fileno()
+
+    def stats(self):
+        """Return statistics about the last transition between movies."""
+        if self._last_transition is None:
+            return {}
+        return {'transition_ms': round(self._last_transition * 1000, 1)}
+
+    def stop(self, block_timeout_sec=0):
+        """Stop playback.  mpv itself keeps running idle for the next movie."""
+        self._command('stop')
+        self._playing = False
+        self._preloaded = None
+        self._advanced = False
+        self._ended_at = None
+
+    def _shutdown(self):
+        self._command('quit')
+        self._close_socket()
+        if self._process is not None:
+            self._process.stop(1)
+            self._process = None
+
+    @staticmethod
+    def can_loop_count():
+        return True
+
+
+def create_player(config, **kwargs):
+    """Create new video player based on mpv."""
+    return MPVPlayer(config)
@@ -3,11 +3,21 @@
 # License: GNU GPLv2, see LICENSE.txt
 import os
 import shutil
-import subprocess
+import signal
 import tempfile
 import time
 
 from .alsa_config import parse_hw_device
+from .process_manager import PlayerProcess
+
+# Every new omxplayer instance gets a lower dispmanx layer than the one before,
+# so the paused standby player is always hidden behind the playing one.
+_TOP_LAYER = 2**30
+_BOTTOM_LAYER = 1
+# The paused standby player is stopped while the other one keeps playing,
+# don't block the main loop too long for it.
+STANDBY_STOP_TIMEOUT_SEC = 1
+
 
 class OMXPlayer:
 
@@ -17,6 +27,15 @@ class OMXPlayer:
         """
         self._process = None
         self._temp_directory = None
+        # Warm standby for gapless playback: (process, key) of the paused
+        # player for the movie that is expected to play next.
+        self._standby = None
+        self._layer = _TOP_LAYER
+        self._srt_slot = 0
+        self._vol = 0
+        self._ended_at = None
+        self._last_transition = None
+        self._last_stop = None
         self._load_config(config)
 
     def __del__(self):
@@ -38,6 +57,7 @@ class OMXPlayer:
         self._alsa_hw_device = parse_hw_device(config.get('alsa', 'hw_device'))
         if self._alsa_hw_device != None and self._sound == 'alsa':
             self._sound = 'alsa:hw:{},{}'.format(self._alsa_hw_device[0], self._alsa_hw_device[1])
+        self._gapless = config.getboolean('omxplayer', 'gapless')
         self._show_titles = config.getboolean('omxplayer', 'show_titles')
         if self._show_titles:
             title_duration = config.getint('omxplayer', 'title_duration')
@@ -52,13 +72,24 @@ class OMXPlayer:
         """Return list of supported file extensions."""
         return self._extensions
 
-    def play(self, movie, loop=None, vol=0):
-        """Play the provided movie file, optionally looping it repeatedly."""
-        self.stop(3)  # Up to 3 second delay to let the old player stop.
+    def _movie_key(self, movie, loop, vol):
+        """Return everything that ends up on the command line for a movie."""
+        if loop is None:
+            loop = movie.repeats
+        return (movie.target, movie.title, loop <= -1, vol)
+
+    def _spawn(self, movie, loop, vol):
+        """Start an omxplayer process for movie on a fresh layer."""
         # Assemble list of arguments.
         args = ['omxplayer']
         args.extend(['-o', self._sound])  # Add sound arguments.
         args.extend(self._extra_args)     # Add extra arguments from config.
+        if self._gapless:
+            # Two instances run at the same time, each needs its own layer
+            # and D-Bus name.
+            args.extend(['--layer', str(self._layer)])
+            args.extend(['--dbus_name', 'org.mpris.MediaPlayer2.omxplayer{0}'.format(self._layer)])
+            self._layer -= 1
         if vol != 0:
             args.extend(['--vol', str(vol)])
         if loop is None:
@@ -66,52 +97,110 @@ class OMXPlayer:
         if loop <= -1:
             args.append('--loop')  # Add loop parameter if necessary.
         if self._show_titles and movie.title:
-            srt_path = os.path.join(self._get_temp_directory(), 'video_looper.srt')
+            # Alternate between two subtitle files so preparing the standby
+            # player never rewrites the file of the playing one.
+            srt_path = os.path.join(self._get_temp_directory(),
+                                    'video_looper_{0}.srt'.format(self._srt_slot))
+            self._srt_slot = 1 - self._srt_slot
             with open(srt_path, 'w') as f:
                 f.write(self._subtitle_header)
                 f.write(movie.title)
             args.extend(['--subtitles', srt_path])
         args.append(movie.target)       # Add movie file path.
         # Run omxplayer process and direct standard output to /dev/null.
-        # Establish input pipe for commands
-        self._process = subprocess.Popen(args,
-                                         stdout=open(os.devnull, 'wb'),
-                                         stdin=subprocess.PIPE,
-                                         close_fds=True)
+        # Establish input pipe for commands.  Every player gets its own
+        # process group so it can be stopped without touching the other one.
+        # SIGINT makes omxplayer shut down cleanly, like Ctrl-C.
+        return PlayerProcess(args, stdin=True, stop_signal=signal.SIGINT)
+
+    def play(self, movie, loop=None, vol=0):
+        """Play the provided movie file, optionally looping it repeatedly."""
+        key = self._movie_key(movie, loop, vol)
+        standby, self._standby = self._standby, None
+        if standby is not None and standby[1] == key and standby[0].poll() is None \
+                and not self.is_playing():
+            # The standby player is already paused at the first frame of the
+            # movie, resuming it is all that is needed.
+            self._process = standby[0]
+            self._process.write('p')
+        else:
+            if standby is not None:
+                standby[0].stop(STANDBY_STOP_TIMEOUT_SEC)
+            self.stop(3)  # Up to 3 second delay to let the old player stop.
+            self._process = self._spawn(movie, loop, vol)
+        self._vol = vol
+        if self._ended_at is not None:
+            self._last_transition = time.monotonic() - self._ended_at
+        self._ended_at = None
+
+    def preload(self, peek):
+        """Start the movie that will play next paused in the background so
+        the switch to it is gapless.  peek(n) returns the upcoming movies.
+        """
+        if not self._gapless:
+            return
+        upcoming = peek(1)
+        if not upcoming:
+            return
+        movie = upcoming[0]
+        key = self._movie_key(movie, None, self._vol)
+        if self._standby is not None:
+            if self._standby[1] == key and self._standby[0].poll() is None:
+                return
+            self._standby[0].stop(STANDBY_STOP_TIMEOUT_SEC)
+            self._standby = None
+        if self._layer < _BOTTOM_LAYER:
+            # Out of layers below the playing one, start over at the top with
+            # a regular (not gapless) transition.
+            self._layer = _TOP_LAYER
+            return
+        process = self._spawn(movie, None, self._vol)
+        process.write('p')
+        self._standby = (process, key)
+
+    def stats(self):
+        """Return statistics about the last transition between movies and
+        the last time a player was stopped.
+        """
+        stats = {}
+        if self._last_transition is not None:
+            stats['transition_ms'] = round(self._last_transition * 1000, 1)
+            stats['gapless'] = self._gapless
+        if self._last_stop is not None:
+            stats.update(self._last_stop)
+        return stats
 
     def pause(self):
         self.sendKey("p")
     
     def sendKey(self, key: str):
         if self.is_playing():
-            self._process.stdin.write(key.encode())
-            self._process.stdin.flush()
+            self._process.write(key)
 
     def is_playing(self):
         """Return true if the video player is running, false otherwise."""
         if self._process is None:
             return False
-        self._process.poll()
-        return self._process.returncode is None
+        if self._process.poll() is not None:
+            if self._ended_at is None:
+                self._ended_at = time.monotonic()
+            return False
+        return True
 
     def stop(self, block_timeout_sec=0):
         """Stop the video player.  block_timeout_sec is how many seconds to
         block waiting for the player to stop before moving on.
         """
-        # Stop the player if it's running.
-        if self._process is not None and self._process.returncode is None:
-            # There are a couple processes used by omxplayer, so kill both
-            # with a pkill command.
-            subprocess.call(['pkill', '-9', 'omxplayer'])
-        # If a blocking timeout was specified, wait up to that amount of time
-        # for the process to stop.
-        start = time.time()
-        while self._process is not None and self._process.returncode is None:
-            if (time.time() - start) >= block_timeout_sec:
-                break
-            time.sleep(0)
+        # Stop the player if it's running, only its own process group (the
+        # omxplayer script and omxplayer.bin) is signalled.
+        if self._process is not None and self._process.poll() is None:
+            self._process.stop(block_timeout_sec)
+            self._last_stop = self._process.last_stop
         # Let the process be garbage collected.
         self._process = None
+        if self._standby is not None:
+            self._standby[0].stop(min(block_timeout_sec, STANDBY_STOP_TIMEOUT_SEC))
+            self._standby = None
 
     @staticmethod
     def can_loop_count():
@@ -3,11 +3,11 @@
 # License: GNU GPLv2, see LICENSE.txt
 import os
 import shutil
-import subprocess
+import signal
 import tempfile
-import time
 
 from .alsa_config import parse_hw_device
+from .process_manager import PlayerProcess
 
 
 class OMXPlayerDualScreen:
@@ -19,6 +19,7 @@ class OMXPlayerDualScreen:
         self._process_a = None
         self._process_b = None
         self._temp_directory = None
+        self._last_stop = None
         self._load_config(config)
 
     def __del__(self):
@@ -103,52 +104,37 @@ class OMXPlayerDualScreen:
                 f.write(movie.title)
             args.extend(["--subtitles", srt_path])
         args.append(movie.target)
-        return subprocess.Popen(
-            args, stdout=open(os.devnull, "wb"), stdin=subprocess.PIPE, close_fds=True
-        )
+        # Each player runs in its own process group and is stopped on its own,
+        # SIGINT makes omxplayer shut down cleanly.
+        return PlayerProcess(args, stdin=True, stop_signal=signal.SIGINT)
 
     def is_playing(self):
         """Return true if any video player is running, false otherwise."""
-        # To simplify, we'll just check one of the players.
-        # A more robust solution would check both.
-        if self._process_a is None and self._process_b is None:
-            return False
-
-        if self._process_a:
-            self._process_a.poll()
-            if self._process_a.returncode is None:
-                return True
-
-        if self._process_b:
-            self._process_b.poll()
-            if self._process_b.returncode is None:
+        for process in (self._process_a, self._process_b):
+            if process is not None and process.poll() is None:
                 return True
-
         return False
 
     def stop(self, block_timeout_sec=0):
         """Stop both video players."""
-        # Stop the players if they're running.
-        if (self._process_a is not None and self._process_a.returncode is None) or (
-            self._process_b is not None and self._process_b.returncode is None
-        ):
-            subprocess.call(["pkill", "-9", "omxplayer"])
-
-        start = time.time()
-        while (self._process_a is not None and self._process_a.returncode is None) or (
-            self._process_b is not None and self._process_b.returncode is None
-        ):
-            if (time.time() - start) >= block_timeout_sec:
-                break
-            time.sleep(0)
-            if self._process_a:
-                self._process_a.poll()
-            if self._process_b:
-                self._process_b.poll()
+        # Only the process groups of our own players are signalled.
+        processes = [
+            process
+            for process in (self._process_a, self._process_b)
+            if process is not None and process.poll() is None
+        ]
+        for process in processes:
+            process.stop(block_timeout_sec)
+        if processes:
+            self._last_stop = processes[-1].last_stop
 
         self._process_a = None
         self._process_b = None
 
+    def stats(self):
+        """Return statistics about the last time the players were stopped."""
+        return dict(self._last_stop) if self._last_stop else {}
+
     @staticmethod
     def can_loop_count():
         return False
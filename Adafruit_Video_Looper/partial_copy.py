@@ -0,0 +1,111 @@
+# License: GNU GPLv2, see LICENSE.txt
+import json
+import os
+import shutil
+
+from .copy_sync import new_digest
+
+_JOURNAL_SUFFIX = '.journal'
+
+
+class PartialCopies:
+    """Hidden sibling directory of the video directory in which media files
+    are copied before they are moved into place.
+
+    Every partial file has a small journal with the identity of its source
+    (name, size and mtime) and the offset up to which the data is on disk,
+    plus the hash of the data up to there.  When the copy is interrupted (the
+    drive is pulled, the power drops) and the same file shows up again, the
+    copy continues from that offset once the data before it is verified.
+    """
+
+    def __init__(self, target):
+        target = os.path.abspath(target.rstrip('/'))
+        parent, name = os.path.split(target)
+        self.path = os.path.join(parent, '.{0}.partial'.format(name))
+
+    def _paths(self, name):
+        data = os.path.join(self.path, name)
+        return data, data + _JOURNAL_SUFFIX
+
+    @staticmethod
+    def _identity(name, source_stat):
+        return {'name': name, 'size': source_stat.st_size,
+                'mtime_ns': source_stat.st_mtime_ns}
+
+    def start(self, name, source_stat, algorithms):
+        """Return the partial file for a copy of the source with the given
+        name and stat, the offset to continue at and hashlib digests (of the
+        given algorithms) of the data before it.  Without a usable journal
+        the offset is 0.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        data, offset, digests = self._resume(name, source_stat, algorithms)
+        if offset == 0:
+            # A stale journal must not describe the new data.
+            self.discard(name)
+        return data, offset, digests
+
+    def _resume(self, name, source_stat, algorithms):
+        data, journal = self._paths(name)
+        fresh = [new_digest(algorithm) for algorithm in algorithms]
+        try:
+            with open(journal, 'r') as f:
+                state = json.load(f)
+            offset = state['offset']
+            expected = state.get('hash')
+            if state.get('source') != self._identity(name, source_stat) or \
+                    not 0 < offset <= os.path.getsize(data):
+                return data, 0, fresh
+            if expected is None and not algorithms:
+                return data, offset, fresh
+            # The digests are needed for the whole file anyway and show that
+            # the data on disk is what was recorded.
+            check = new_digest()
+            digests = [new_digest(algorithm) for algorithm in algorithms]
+            with open(data, 'rb') as f:
+                remaining = offset
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        return data, 0, fresh
+                    check.update(chunk)
+                    for digest in digests:
+                        digest.update(chunk)
+                    remaining -= len(chunk)
+            if expected is not None and check.hexdigest() != expected:
+                return data, 0, fresh
+            return data, offset, digests
+        except (OSError, ValueError, KeyError, TypeError):
+            return data, 0, fresh
+
+    def checkpoint(self, name, source_stat, offset, digest=None):
+        """Record that the partial file is on disk up to offset.  digest is
+        the BLAKE2b hex digest of the data up to there, if it was hashed.
+        """
+        data, journal = self._paths(name)
+        temp_path = journal + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'source': self._identity(name, source_stat), 'offset': offset,
+                       'hash': digest}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, journal)
+
+    def finish(self, name, dst):
+        """Move the complete file into place at dst."""
+        data, journal = self._paths(name)
+        os.replace(data, dst)
+        self.discard(name)
+
+    def discard(self, name):
+        """Forget the partial copy of name."""
+        for path in self._paths(name):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Remove all partial copies, e.g. of drives that never came back."""
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,86 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import sqlite3
+import threading
+import time
+
+# Seconds plays are kept in memory before they are written, so the SD card
+# isn't written to after every movie.
+FLUSH_INTERVAL = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    path TEXT PRIMARY KEY,
+    last_played REAL NOT NULL,
+    play_count INTEGER NOT NULL
+);
+"""
+
+
+class PlayHistory:
+    """When and how often each media file was played, by path.
+
+    Kept in its own SQLite database under the state_dir (unlike the media
+    index it is not a cache that can be rebuilt).  Plays are buffered and
+    written in one transaction every FLUSH_INTERVAL seconds and by flush().
+    Several instances (e.g. the looper recording and copy mode reading) can
+    use the same database.
+    """
+
+    def __init__(self, db_path, flush_interval=FLUSH_INTERVAL):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        self._flush_interval = flush_interval
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, path, when=None):
+        """Note that path was played (now, or at the unix time when)."""
+        with self._lock:
+            last_played, count = self._pending.get(path, (0, 0))
+            self._pending[path] = (max(last_played, when or time.time()), count + 1)
+        if time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered plays."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            with self._db:
+                self._db.executemany(
+                    'INSERT INTO plays VALUES (?, ?, ?) ON CONFLICT(path) DO UPDATE SET '
+                    'last_played=max(last_played, excluded.last_played), '
+                    'play_count=play_count + excluded.play_count',
+                    [(path, last_played, count)
+                     for path, (last_played, count) in pending.items()])
+
+    def last_played(self, paths):
+        """Return a dict of path -> unix time of the last play for the paths
+        that were played.
+        """
+        result = {}
+        paths = list(paths)
+        with self._lock:
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                result.update(self._db.execute(
+                    'SELECT path, last_played FROM plays WHERE path IN ({0})'.format(
+                        ','.join('?' * len(chunk))), chunk))
+            for path in paths:
+                if path in self._pending:
+                    result[path] = max(result.get(path, 0), self._pending[path][0])
+        return result
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
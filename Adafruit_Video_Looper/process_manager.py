@@ -0,0 +1,118 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import select
+import signal
+import subprocess
+import time
+
+# Seconds a player gets to exit after the graceful signal before it is killed.
+STOP_GRACE_SEC = 0.5
+
+
+class PlayerProcess:
+    """A player process that runs in its own process group.
+
+    Stopping signals only that group (the player and everything it started,
+    like omxplayer.bin started by the omxplayer script), first with a graceful
+    signal and then with SIGKILL.  Waiting for the exit blocks on a pidfd where
+    the kernel supports it instead of polling.
+    """
+
+    def __init__(self, args, stdin=False, stop_signal=signal.SIGTERM):
+        self._stop_signal = stop_signal
+        self._process = subprocess.Popen(args,
+                                         stdout=open(os.devnull, 'wb'),
+                                         stdin=subprocess.PIPE if stdin else None,
+                                         close_fds=True,
+                                         start_new_session=True)
+        self._pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                self._pidfd = os.pidfd_open(self._process.pid)
+            except OSError:
+                pass
+        self.last_stop = None
+
+    def __del__(self):
+        self._close_pidfd()
+
+    def _close_pidfd(self):
+        if getattr(self, '_pidfd', None) is not None:
+            os.close(self._pidfd)
+            self._pidfd = None
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    @property
+    def returncode(self):
+        return self._process.returncode
+
+    def poll(self):
+        """Return the exit code or None if the process is still running."""
+        returncode = self._process.poll()
+        if returncode is not None:
+            self._close_pidfd()
+        return returncode
+
+    def write(self, data):
+        """Write a string to the stdin of the process, if it is still there."""
+        if self._process.stdin is None or self.poll() is not None:
+            return
+        try:
+            self._process.stdin.write(data.encode())
+            self._process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+
+    def _signal_group(self, signum):
+        try:
+            os.killpg(self._process.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _wait_exit(self, timeout):
+        """Block until the process exited (without reaping it if a pidfd is
+        available) or timeout seconds passed.  Returns true if it exited.
+        """
+        if self._process.returncode is not None:
+            return True
+        if self._pidfd is not None:
+            poller = select.poll()
+            poller.register(self._pidfd, select.POLLIN)
+            return bool(poller.poll(max(0, timeout) * 1000))
+        try:
+            self._process.wait(timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    def stop(self, timeout=3):
+        """Stop the process group.  With a timeout of 0 it is killed right
+        away without waiting, otherwise it gets the graceful stop signal and
+        STOP_GRACE_SEC seconds before SIGKILL, and this waits up to timeout
+        seconds in total.  Returns true if the process is gone.
+        """
+        if self.poll() is not None:
+            return True
+        start = time.monotonic()
+        cpu_start = time.process_time()
+        if timeout <= 0:
+            self._signal_group(signal.SIGKILL)
+            exited = False
+        else:
+            self._signal_group(self._stop_signal)
+            exited = self._wait_exit(min(STOP_GRACE_SEC, timeout))
+            if not exited:
+                self._signal_group(signal.SIGKILL)
+                exited = self._wait_exit(timeout - (time.monotonic() - start))
+        if exited and self._pidfd is not None:
+            # The leader is a zombie now, so the group id can't have been
+            # reused yet: make sure no child of the player is left behind.
+            self._signal_group(signal.SIGKILL)
+        self.poll()
+        self.last_stop = {'stop_ms': round((time.monotonic() - start) * 1000, 1),
+                          'stop_cpu_ms': round((time.process_time() - cpu_start) * 1000, 1),
+                          'stop_forced': not exited or self._process.returncode == -signal.SIGKILL}
+        return exited
@@ -0,0 +1,182 @@
+# License: GNU GPLv2, see LICENSE.txt
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .image_decoder import DECODER, fit_image, is_animated, load_image
+
+# Renditions are stored uncompressed so loading them is a plain read, images
+# with transparency as TGA which keeps the alpha channel.
+_EXTENSIONS = ('.bmp', '.tga')
+
+
+def render_image(source, target, screen_size, scale, center):
+    """Load source, fit it to the screen and save it to target (without
+    extension), runs in the worker processes.  Returns the written path, or
+    None for animated images which are not rendered.
+    """
+    import pygame
+    if is_animated(source):
+        return None
+    image = load_image(source, screen_size, scale)
+    size, _ = fit_image(image.get_size(), screen_size, scale, center)
+    if size != image.get_size():
+        image = pygame.transform.scale(image, size)
+    path = target + ('.tga' if image.get_flags() & pygame.SRCALPHA else '.bmp')
+    temp_path = path + '.tmp' + os.path.splitext(path)[1]
+    pygame.image.save(image, temp_path)
+    os.replace(temp_path, path)
+    return path
+
+
+class RenditionCache:
+    """Directory of images already fitted to the screen.
+
+    Renditions are keyed by the path, size and mtime of the original, the
+    screen size, the scale/center settings and the decoder, so a changed file
+    or display gets new ones.  prepare() renders the missing renditions of a playlist in a
+    process pool, the least recently used ones are deleted once the directory
+    grows beyond max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes, screen_size, scale, center, workers=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._screen_size = tuple(screen_size)
+        self._scale = scale
+        self._center = center
+        self._workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._remove_temp_files()
+        self._bytes = sum(size for _, size, _ in self._list())
+
+    def _remove_temp_files(self):
+        """Delete half written renditions of workers that were killed."""
+        with os.scandir(self._directory) as it:
+            for entry in it:
+                if '.tmp' in entry.name:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def _list(self):
+        """Return (path, size, mtime) of all renditions."""
+        files = []
+        with os.scandir(self._directory) as it:
+            for entry in it:
+                if entry.name.endswith(_EXTENSIONS) and '.tmp' not in entry.name:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((entry.path, st.st_size, st.st_mtime))
+        return files
+
+    def _target(self, path):
+        """Return the rendition path (without extension) for an original."""
+        st = os.stat(path)
+        key = '\0'.join(str(part) for part in (
+            os.path.realpath(path), st.st_size, st.st_mtime_ns,
+            '{0}x{1}'.format(*self._screen_size), self._scale, self._center, DECODER))
+        return os.path.join(self._directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def lookup(self, path, touch=True):
+        """Return the path of the rendition of an original, or None if there
+        is none yet.  With touch it counts as used (it is displayed).
+        """
+        try:
+            target = self._target(path)
+        except OSError:
+            return None
+        for extension in _EXTENSIONS:
+            rendition = target + extension
+            try:
+                if touch:
+                    # The mtime of a rendition is its last use, for the eviction.
+                    os.utime(rendition)
+                elif not os.path.exists(rendition):
+                    continue
+                return rendition
+            except OSError:
+                continue
+        return None
+
+    def prepare(self, paths):
+        """Render the renditions that are missing for paths in the background,
+        in order and only as many as fit into the size budget.
+        """
+        estimate = self._screen_size[0] * self._screen_size[1] * 3
+        budget = self._max_bytes
+        for path in paths:
+            budget -= estimate
+            if budget < 0:
+                break
+            # Only checked, writing the mtime of every entry of a playlist
+            # would wear out the SD card.
+            if self.lookup(path, touch=False) is not None:
+                continue
+            try:
+                target = self._target(path)
+            except OSError:
+                continue
+            with self._lock:
+                if target in self._pending:
+                    continue
+                if self._pool is None:
+                    # Spawned workers don't inherit the display of this process.
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self._workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+                future = self._pool.submit(render_image, path, target, self._screen_size,
+                                           self._scale, self._center)
+                self._pending[target] = future
+            future.add_done_callback(lambda f, target=target: self._rendered(target, f))
+
+    def _rendered(self, target, future):
+        with self._lock:
+            self._pending.pop(target, None)
+        try:
+            path = future.result()
+            if path is None:
+                return
+            size = os.path.getsize(path)
+        except Exception:
+            # Unreadable originals are reported when they are displayed.
+            return
+        with self._lock:
+            self._bytes += size
+            if self._bytes > self._max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete the least recently used renditions until the cache fits
+        into its budget.  Must be called with the lock held.
+        """
+        files = sorted(self._list(), key=lambda f: f[2])
+        self._bytes = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self._bytes <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._bytes -= size
+
+    def close(self):
+        """Cancel the queued renders and let the workers exit, only the ones
+        already running are finished.
+        """
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
@@ -0,0 +1,127 @@
+# License: GNU GPLv2, see LICENSE.txt
+import ctypes
+import errno
+import os
+import shutil
+import stat
+
+from .copy_engine import copy_file
+
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_renameat2 = getattr(_libc, 'renameat2', None)
+if _renameat2 is not None:
+    _renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+                           ctypes.c_uint]
+    _renameat2.restype = ctypes.c_int
+
+
+def exchange(path_a, path_b):
+    """Atomically swap two paths on the same filesystem (renameat2 with
+    RENAME_EXCHANGE).  Raises OSError with ENOSYS if the C library does not
+    provide it.
+    """
+    if _renameat2 is None:
+        raise OSError(errno.ENOSYS, 'renameat2 is not available')
+    if _renameat2(_AT_FDCWD, os.fsencode(path_a), _AT_FDCWD, os.fsencode(path_b),
+                  _RENAME_EXCHANGE) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path_a, None, path_b)
+
+
+def fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class StagingArea:
+    """A hidden sibling directory in which the new content of a directory is
+    put together, to replace the directory in one step.
+
+    The swap is atomic with renameat2 and otherwise done by two renames, in
+    which case recover() finishes an interrupted swap.  Either way a power cut
+    leaves the complete old or the complete new content behind.
+    """
+
+    def __init__(self, target):
+        target = os.path.abspath(target.rstrip('/'))
+        parent, name = os.path.split(target)
+        self.target = target
+        self.path = os.path.join(parent, '.{0}.staging'.format(name))
+        self._old = os.path.join(parent, '.{0}.old'.format(name))
+        # Files that failed verification, kept for inspection but never
+        # played.  Only the latest bad copy of each name is kept.
+        self.quarantine_path = os.path.join(parent, '.{0}.quarantine'.format(name))
+        self._parent = parent
+
+    def recover(self):
+        """Clean up after an interrupted copy or swap."""
+        if not os.path.isdir(self.target):
+            # Crashed between the two renames of a swap: the staging
+            # directory is complete, it only gets renamed once it is.
+            for candidate in (self.path, self._old):
+                if os.path.isdir(candidate):
+                    os.rename(candidate, self.target)
+                    break
+        for leftover in (self.path, self._old):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover, ignore_errors=True)
+
+    def prepare(self, keep):
+        """Create an empty staging directory and hardlink the files of the
+        target whose name keep(name) accepts into it.
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        with os.scandir(self.target) as it:
+            for entry in it:
+                if not entry.is_file(follow_symlinks=False) or not keep(entry.name):
+                    continue
+                destination = os.path.join(self.path, entry.name)
+                try:
+                    os.link(entry.path, destination)
+                except OSError:
+                    # No hardlinks on this filesystem.
+                    copy_file(entry.path, destination)
+
+    def quarantine(self, name):
+        """Move a file out of the staging directory into quarantine."""
+        os.makedirs(self.quarantine_path, exist_ok=True)
+        os.replace(os.path.join(self.path, name), os.path.join(self.quarantine_path, name))
+
+    def discard(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _copy_permissions(self):
+        """Give the staging directory the mode and owner of the target, it
+        was created by root (the pi user must keep write access).
+        """
+        st = os.stat(self.target)
+        os.chmod(self.path, stat.S_IMODE(st.st_mode))
+        try:
+            os.chown(self.path, st.st_uid, st.st_gid)
+        except PermissionError:
+            # Not running as root, the owner is ours anyway.
+            pass
+
+    def commit(self):
+        """Replace the target with the staging directory."""
+        self._copy_permissions()
+        fsync_directory(self.path)
+        try:
+            exchange(self.path, self.target)
+            old = self.path
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            os.rename(self.target, self._old)
+            os.rename(self.path, self.target)
+            old = self._old
+        fsync_directory(self._parent)
+        shutil.rmtree(old, ignore_errors=True)
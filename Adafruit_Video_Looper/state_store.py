@@ -0,0 +1,82 @@
+# License: GNU GPLv2, see LICENSE.txt
+import json
+import os
+from time import monotonic
+
+
+class StateStore:
+    """Small JSON document of playback state (like the position in the
+    playlist) kept in a file under the state_dir.
+
+    Changes are kept in memory and written at most every interval seconds,
+    always to a temporary file that is fsync'd and renamed over the old one,
+    so frequent updates neither wear out the SD card nor leave a broken file
+    after a power cut.  The owner calls maybe_flush() when next_timeout()
+    says a write is due and flush() before exiting.
+    """
+
+    def __init__(self, path, interval):
+        self._path = path
+        self._interval = interval
+        self._data = {}
+        self._dirty = False
+        self._last_write = None
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._data = data
+        except (OSError, ValueError):
+            pass
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        if self._data.get(key) == value:
+            return
+        self._data[key] = value
+        self._dirty = True
+        self.maybe_flush()
+
+    def update(self, key, **fields):
+        """Change some fields of the dict stored under key."""
+        value = dict(self._data.get(key) or {})
+        value.update(fields)
+        self.set(key, value)
+
+    def next_timeout(self):
+        """Return the seconds until pending changes should be written, None
+        if there are none.
+        """
+        if not self._dirty:
+            return None
+        if self._last_write is None:
+            return 0
+        return max(0, self._last_write + self._interval - monotonic())
+
+    def maybe_flush(self):
+        """Write pending changes if the interval has passed."""
+        if self.next_timeout() == 0:
+            try:
+                self.flush()
+            except OSError as e:
+                print('Saving state to {0} failed: {1}'.format(self._path, e))
+                # try again after the interval
+                self._last_write = monotonic()
+
+    def flush(self):
+        """Write pending changes now."""
+        if not self._dirty:
+            return
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._path)
+        self._dirty = False
+        self._last_write = monotonic()
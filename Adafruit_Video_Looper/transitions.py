@@ -0,0 +1,181 @@
+# License: GNU GPLv2, see LICENSE.txt
+from time import monotonic
+
+import pygame
+
+
+class TransitionEngine:
+    """Frame paced crossfade and Ken Burns (slow zoom and pan) rendering.
+
+    Nothing here blocks: start() sets up a transition and draws its first
+    frame, the owner calls tick() from the main loop (the player's update())
+    and next_timeout() tells the main loop when the next frame is due.
+    Progress is computed from the clock, so a late frame does not slow the
+    animation down but is counted as dropped.  Frames are composed into
+    buffers that are allocated once per screen (and image) size.
+    """
+
+    def __init__(self, screen, draw_background, fps, fade_duration, zoom):
+        """draw_background(surface) fills a surface with the background, zoom
+        is the Ken Burns magnification at the end of the display time (1 to
+        disable it).
+        """
+        self._screen = screen
+        self._draw_background = draw_background
+        self._frame_time = 1.0 / max(1, fps)
+        self._fade_duration = max(0.0, fade_duration)
+        self._zoom = max(1.0, zoom)
+        self._outgoing = None
+        self._incoming = None
+        self._zoomed = None
+        self._image = None
+        self._position = (0, 0)
+        self._duration = None
+        self._start = 0
+        self._paused_at = None
+        self._active = False
+        self._last_frame = None
+        self._next_frame = None
+        self._pan = 0
+        self._frames = 0
+        self._dropped = 0
+        self._over_budget = 0
+        self._max_frame_time = 0
+        self._last_stats = {}
+
+    @property
+    def enabled(self):
+        return self._fade_duration > 0 or self._zoom > 1
+
+    def _buffer(self, current, size, alpha=False):
+        """Return current if it has the size and alpha, a new display format
+        surface otherwise.
+        """
+        if current is None or current.get_size() != size or \
+                bool(current.get_flags() & pygame.SRCALPHA) != alpha:
+            if alpha:
+                current = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+            else:
+                current = pygame.Surface(size).convert()
+        return current
+
+    def start(self, image, position, duration):
+        """Start showing image (a surface in display format) at position for
+        duration seconds (None if it is shown until stopped).
+        """
+        size = self._screen.get_size()
+        self._outgoing = self._buffer(self._outgoing, size)
+        self._incoming = self._buffer(self._incoming, size)
+        # Keep what is on the screen right now to fade from.
+        self._outgoing.blit(self._screen, (0, 0))
+        self._image = image
+        self._position = position
+        self._duration = duration
+        self._start = monotonic()
+        self._paused_at = None
+        self._pan = (self._pan + 1) % 4
+        if self._frames:
+            self._last_stats = self._stats()
+        self._last_frame = None
+        self._next_frame = self._start
+        self._frames = 0
+        self._dropped = 0
+        self._over_budget = 0
+        self._max_frame_time = 0
+        self._active = True
+        self.tick()
+
+    def _ken_burns(self):
+        return self._zoom > 1 and self._duration is not None and self._duration > 0
+
+    def _compose_incoming(self, elapsed):
+        """Draw background and (zoomed) image into the incoming buffer."""
+        self._draw_background(self._incoming)
+        if not self._ken_burns():
+            self._incoming.blit(self._image, self._position)
+            return
+        progress = min(1.0, elapsed / self._duration)
+        zoom = 1 + (self._zoom - 1) * progress
+        image_w, image_h = self._image.get_size()
+        crop_w, crop_h = int(image_w / zoom), int(image_h / zoom)
+        # Zoom towards a different corner for every image.
+        anchor_x = (image_w - crop_w) * (0.5 + (0.5 if self._pan in (1, 2) else -0.5) * progress)
+        anchor_y = (image_h - crop_h) * (0.5 + (0.5 if self._pan in (2, 3) else -0.5) * progress)
+        crop = self._image.subsurface((int(anchor_x), int(anchor_y), crop_w, crop_h))
+        self._zoomed = self._buffer(self._zoomed, (image_w, image_h),
+                                    bool(self._image.get_flags() & pygame.SRCALPHA))
+        pygame.transform.scale(crop, (image_w, image_h), self._zoomed)
+        self._incoming.blit(self._zoomed, self._position)
+
+    def _render(self, elapsed):
+        self._compose_incoming(elapsed)
+        if self._fade_duration > 0 and elapsed < self._fade_duration:
+            self._screen.blit(self._outgoing, (0, 0))
+            self._incoming.set_alpha(int(255 * elapsed / self._fade_duration))
+            self._screen.blit(self._incoming, (0, 0))
+            self._incoming.set_alpha(None)
+        else:
+            self._screen.blit(self._incoming, (0, 0))
+        pygame.display.flip()
+
+    def _finished(self, elapsed):
+        if elapsed < self._fade_duration:
+            return False
+        if self._ken_burns():
+            return elapsed >= self._duration
+        return True
+
+    def tick(self):
+        """Render the next frame if it is due."""
+        if not self._active or self._paused_at is not None:
+            return
+        now = monotonic()
+        if now < self._next_frame:
+            return
+        elapsed = now - self._start
+        frame = int(elapsed / self._frame_time)
+        if self._last_frame is not None and frame > self._last_frame + 1:
+            self._dropped += frame - self._last_frame - 1
+        self._render(elapsed)
+        render_time = monotonic() - now
+        self._frames += 1
+        self._max_frame_time = max(self._max_frame_time, render_time)
+        if render_time > self._frame_time:
+            self._over_budget += 1
+        self._last_frame = frame
+        self._next_frame = self._start + (frame + 1) * self._frame_time
+        if self._finished(elapsed):
+            self._active = False
+
+    def next_timeout(self):
+        """Return the seconds until the next frame is due, None if there is
+        nothing to animate.
+        """
+        if not self._active or self._paused_at is not None:
+            return None
+        return max(0, self._next_frame - monotonic())
+
+    def pause(self, paused):
+        if paused and self._paused_at is None:
+            self._paused_at = monotonic()
+        elif not paused and self._paused_at is not None:
+            # Continue where the animation was paused.
+            shift = monotonic() - self._paused_at
+            self._start += shift
+            self._next_frame += shift
+            self._paused_at = None
+
+    def stop(self):
+        self._active = False
+        self._image = None
+
+    def stats(self):
+        """Return the frame counters of the previous image, the current one
+        is still being animated.
+        """
+        return self._last_stats
+
+    def _stats(self):
+        return {'frames': self._frames, 'dropped_frames': self._dropped,
+                'over_budget_frames': self._over_budget,
+                'max_frame_ms': round(self._max_frame_time * 1000, 1)}
@@ -34,7 +34,11 @@ class USBDriveReader:
         """Return true if the file search paths have changed, like when a new
         USB drive is inserted.
         """
-        return self._mounter.poll_changes()
+        return bool(self._mounter.poll_changes())
+
+    def fileno(self):
+        """Return a file descriptor that becomes readable on drive changes."""
+        return self._mounter.fileno()
 
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
@@ -0,0 +1,151 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import threading
+
+from .copy_sync import format_size
+from .drive_probe import (COPY, DIRECT, STAGE, ThroughputCache, choose_mode, estimate_bitrate,
+                          measure_throughput)
+from .media_index import locate_mount
+from .usb_drive_copymode import USBDriveReaderCopy
+
+
+class USBDriveReaderAuto(USBDriveReaderCopy):
+    """Copy mode file reader that decides for each drive if it is copied.
+
+    Every new drive gets a short sequential read benchmark (cached by its
+    filesystem UUID) that is compared with the bitrates of its media.  Drives
+    fast enough for all files are played directly, drives too slow for some
+    files only get these copied (staged) into the video directory and the
+    others are copied completely, like in copy mode.
+    """
+
+    def __init__(self, config, screen):
+        self._margin = config.getfloat('usb_drive_auto', 'margin')
+        # Mbit/s -> bytes/s
+        self._assumed_bitrate = config.getfloat('usb_drive_auto', 'assumed_bitrate') * 125000
+        self._probe_bytes = config.getint('usb_drive_auto', 'probe_size') * 1024 * 1024
+        # mount point -> (mode, names of the files that are copied)
+        self._drives = {}
+        self._drives_lock = threading.Lock()
+        self._drive_removed = False
+        super().__init__(config, screen)
+        self._speeds = ThroughputCache(os.path.join(self._state_dir, 'drive_speed.json'))
+
+    def _classify(self, path):
+        """Measure (or look up) the speed of the drive at path and decide how
+        to use it.  Returns the mode and the names of the files the drive is
+        too slow for.
+        """
+        media = super()._list_media(path)
+        if not media:
+            return COPY, set()
+        try:
+            source = locate_mount(path)[0]
+        except OSError:
+            source = None
+        speed = self._speeds.get(source) if source is not None else None
+        if speed is None:
+            self._info("Measuring drive speed...")
+            largest = max(media, key=lambda f: f[2])[0]
+            try:
+                speed = measure_throughput(largest, self._probe_bytes)
+            except OSError as e:
+                print('Measuring drive speed failed: {0}'.format(e))
+            if speed is not None and source is not None:
+                self._speeds.put(source, speed)
+        bitrates = {name: estimate_bitrate(src) or self._assumed_bitrate
+                    for src, name, _ in media}
+        mode = choose_mode(speed, list(bitrates.values()), self._margin)
+        slow = set(name for name, bitrate in bitrates.items()
+                   if speed is None or speed < bitrate * self._margin)
+        self._info("Drive reads {0}/s: {1}".format(format_size(speed or 0), mode))
+        return mode, slow
+
+    def _copy_files(self, paths):
+        copy_paths = []
+        added = False
+        for path in paths:
+            if self._password and not self.check_file_exists(
+                    '{0}/{1}'.format(path.rstrip('/'), self._password)):
+                # skipped by the copy as well
+                copy_paths.append(path)
+                continue
+            mode, slow = self._classify(path)
+            with self._drives_lock:
+                self._drives[path] = (mode, slow)
+            if mode != DIRECT:
+                copy_paths.append(path)
+            if mode != COPY:
+                added = True
+        changed = super()._copy_files(copy_paths) if copy_paths else False
+        return changed or added
+
+    def _drive_copy_mode(self, path):
+        with self._drives_lock:
+            mode, _ = self._drives.get(path, (COPY, None))
+        if mode == STAGE:
+            return 'add', '(only files the drive is too slow for)'
+        return None
+
+    def _list_media(self, path):
+        files = super()._list_media(path)
+        with self._drives_lock:
+            mode, slow = self._drives.get(path, (COPY, None))
+        if mode == STAGE:
+            files = [f for f in files if f[1] in slow]
+        return files
+
+    def _drive_changed(self, change):
+        super()._drive_changed(change)
+        if change.action == 'remove' and change.path is not None:
+            with self._drives_lock:
+                if self._drives.pop(change.path, None) is not None:
+                    self._drive_removed = True
+
+    def search_paths(self):
+        """Return the video directory and the drives that are played
+        directly.
+        """
+        paths = super().search_paths()
+        with self._drives_lock:
+            return paths + sorted(path for path, (mode, _) in self._drives.items()
+                                  if mode != COPY)
+
+    def is_file_ready(self, path):
+        """Files the drive is too slow for are played from their copy.  Files
+        in subdirectories of such a drive (scan_depth) were not measured,
+        they wait until its copy is done.
+        """
+        with self._drives_lock:
+            drives = list(self._drives.items())
+        for drive, (mode, slow) in drives:
+            try:
+                if os.path.commonpath([drive, path]) != drive:
+                    continue
+            except ValueError:
+                continue
+            if mode != STAGE:
+                return True
+            relpath = os.path.relpath(path, drive)
+            if os.path.dirname(relpath):
+                return not self._copying()
+            return relpath not in slow
+        return True
+
+    def is_changed(self):
+        changed = super().is_changed()
+        if self._drive_removed:
+            self._drive_removed = False
+            return True
+        return changed
+
+    def idle_message(self):
+        """Return a message to display when idle and no files are found."""
+        return 'Insert USB drive with compatible movies. Fast drives are played, slow ones copied.'
+
+
+def create_file_reader(config, screen):
+    """Create new file reader that plays or copies USB drives depending on
+    their speed.
+    """
+    return USBDriveReaderAuto(config, screen)
@@ -3,12 +3,35 @@
 # License: GNU GPLv2, see LICENSE.txt
 import glob
 import os
-import shutil
 import re
+import select
+import threading
 import pygame
 import time
+from .content_store import ContentStore
+from .copy_engine import CopyProgress, copy_file
+from .copy_space import (EVICTION_POLICIES, available_bytes, eviction_order, freed_bytes,
+                         plan_space)
+from .partial_copy import PartialCopies
+from .play_history import PlayHistory
+from .playlist_builders import build_playlist_m3u
+from .copy_sync import (MANIFEST_NAME, Manifest, format_size, plan_bytes, plan_sync,
+                        read_checksums)
+from .staging import StagingArea
 from .usb_drive_mounter import USBDriveMounter
 
+# Seconds between progress lines on the console while copying in the background.
+BACKGROUND_PROGRESS_INTERVAL = 5
+
+# Seconds until mounting a drive that failed to mount is tried again, doubled
+# after every failure up to the maximum.
+MOUNT_RETRY_DELAY = 2
+MOUNT_RETRY_MAX_DELAY = 60
+
+# How often a file whose checksum doesn't match is copied before it is put
+# into quarantine.
+VERIFY_ATTEMPTS = 2
+
 
 class USBDriveReaderCopy(object):
 
@@ -25,10 +48,36 @@ class USBDriveReaderCopy(object):
                                         readonly=self._readonly)
         self._mounter.start_monitor()
 
+        # Finish or clean up a copy that was interrupted (e.g. by a power cut).
+        self._staging = StagingArea(self._target_path)
+        self._staging.recover()
+        self._store = ContentStore(self._target_path) if self._dedup else None
+        # Copies interrupted by pulling the drive or a power cut are kept
+        # there and continued when the same files show up again.
+        self._partial = PartialCopies(self._target_path)
         if not os.path.exists(self._target_path):
             os.makedirs(self._target_path)
         #subprocess.call(['mkdir', self._target_path])
 
+        # State of the background copy.  The worker writes to the pipe when it
+        # is done, the epoll fd combines it with the udev monitor so the main
+        # loop can wait on both.
+        self._worker = None
+        self._copy_swapped = False
+        # Files of the running copy that are complete, for poll_additions().
+        self._additions = []
+        self._additions_lock = threading.Lock()
+        # Partitions added since the last copy, None for all attached ones.
+        self._pending_nodes = None
+        # node -> (monotonic time of the next attempt, delay) of partitions
+        # that failed to mount, they stay pending.
+        self._mount_retries = {}
+        self._first_search = True
+        self._wakeup_r, self._wakeup_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self._epoll = select.epoll()
+        self._epoll.register(self._mounter.fileno(), select.EPOLLIN)
+        self._epoll.register(self._wakeup_r, select.EPOLLIN)
+
     def _pygame_init(self, config):
         self._bgcolor = (52,52,52)
         self._fgcolor = (149,193,26)
@@ -57,13 +106,258 @@ class USBDriveReaderCopy(object):
         self._copy_mode = config.get('copymode', 'mode')
         self._copyloader = config.getboolean('copymode', 'copyloader')
         self._password = config.get('copymode', 'password')
+        self._sync_hash = config.getboolean('copymode', 'sync_hash')
+        self._background = config.getboolean('copymode', 'background')
+        self._verify = config.getboolean('copymode', 'verify')
+        self._dedup = config.getboolean('copymode', 'dedup')
+        self._playlist_path = config.get('playlist', 'path') if config.has_option('playlist', 'path') else ''
+        self._eviction = config.get('copymode', 'eviction')
+        if self._eviction not in EVICTION_POLICIES:
+            raise RuntimeError('Unknown copymode eviction {0}, expected one of {1}'.format(
+                self._eviction, ', '.join(EVICTION_POLICIES)))
+        self._max_size = config.getint('copymode', 'max_size') * 1024 * 1024
+        self._min_free = config.getint('copymode', 'min_free') * 1024 * 1024
+        self._state_dir = config.get('video_looper', 'state_dir')
+        self._console_output = config.getboolean('video_looper', 'console_output')
 
         self._extensions = '|'.join(config.get(self._config.get('video_looper', 'video_player'), 'extensions') \
                                  .translate(str.maketrans('','', ' \t\r\n.')) \
                                  .split(','))
 
+    def _is_media(self, name):
+        return re.search('\\.({0})$'.format(self._extensions), name, flags=re.IGNORECASE) is not None
+
+    def _print(self, message):
+        """Print a status message if console output is enabled."""
+        if self._console_output:
+            print(message)
+
+    def _info(self, message):
+        """Show a message about the copy, on the console while copying in the
+        background (the screen belongs to the player then).
+        """
+        if self._background:
+            self._print(message)
+        else:
+            self._draw_info_text(message)
+
+    def _playlist_file(self, path):
+        """Return the m3u playlist on the drive: the playlist of the config if
+        it is a relative path, otherwise the first one in the top directory.
+        """
+        if self._playlist_path and not os.path.isabs(self._playlist_path):
+            candidate = os.path.join(path, self._playlist_path)
+            if os.path.isfile(candidate):
+                return candidate
+        candidates = sorted(glob.glob(os.path.join(glob.escape(path), '*.m3u')) +
+                            glob.glob(os.path.join(glob.escape(path), '*.m3u8')))
+        return candidates[0] if candidates else None
+
+    def _playlist_order(self, files, playlist_file):
+        """Sort a list of (source path, name, size) so the files of the m3u
+        playlist come first, in its order.
+        """
+        try:
+            movies = build_playlist_m3u(playlist_file).movies
+        except (OSError, UnicodeDecodeError) as e:
+            print('Reading playlist {0} failed: {1}'.format(playlist_file, e))
+            return files
+        order = {}
+        for index, movie in enumerate(movies):
+            order.setdefault(movie.filename, index)
+        return sorted(files, key=lambda f: order.get(f[1], len(order)))
+
+    def _announce(self, path):
+        """Make a copied file available to poll_additions()."""
+        if not self._background:
+            return
+        with self._additions_lock:
+            self._additions.append(path)
+        os.write(self._wakeup_w, b'x')
+
+    def _print_copy_progress(self, progress):
+        self._print("Copying file {0}/{1}: {2}% ({3}/s)".format(
+            progress.file_index, progress.total_files, int(round(100 * progress.fraction)),
+            format_size(progress.bytes_per_second)))
+
+    def _new_progress(self, total_bytes, total_files):
+        if self._background:
+            return CopyProgress(total_bytes, total_files, self._print_copy_progress,
+                                rate=1.0 / BACKGROUND_PROGRESS_INTERVAL)
+        self._clear_screen(False)
+        return CopyProgress(total_bytes, total_files, self._draw_copy_progress)
+
+    def _copy_batch(self, files, manifest, directory, checksums):
+        """Copy a list of (source path, name, size) into directory with one
+        progress bar for all of them.  checksums maps source paths to the
+        (algorithm, hex digest) they must have.  Returns the names of the
+        files that failed verification.
+        """
+        progress = self._new_progress(sum(size for _, _, size in files), len(files))
+        failed = []
+        for src, name, size in files:
+            if not self._copy_media(src, name, manifest, progress, directory,
+                                    checksums.get(src)):
+                failed.append(name)
+        # Written once, an interrupted batch is redone from the partial
+        # copies anyway (the staging directory is discarded).
+        manifest.save()
+        progress.finish()
+        return failed
+
+    def _copy_media(self, src, name, manifest, progress, directory, expected=None):
+        """Copy a media file into directory, keeping its mtime, and record it
+        in the manifest (the caller saves it).  The file is hashed while it is copied and compared
+        to the expected (algorithm, hex digest), if given.  Content that is
+        in the store already is linked instead of copied, an interrupted copy
+        of the same file is continued.  Returns false if it didn't match after
+        VERIFY_ATTEMPTS copies.
+        """
+        dst = '{0}/{1}'.format(directory.rstrip('/'), name)
+        progress.start_file(name)
+        st = os.stat(src)
+        if self._store is not None:
+            known = expected[1] if expected is not None and expected[0] == 'blake2b' else None
+            obj, digest = self._store.lookup(src, st.st_size, known)
+            if obj is not None:
+                self._store.link(obj, dst)
+                progress.finish_file(st.st_size)
+                manifest.record(name, st, dst, digest)
+                self._announce(dst)
+                return True
+        hashed = self._verify or self._sync_hash or self._store is not None
+        algorithms = ['blake2b'] if hashed else []
+        if expected is not None and expected[0] != 'blake2b':
+            algorithms.append(expected[0])
+        for attempt in range(VERIFY_ATTEMPTS):
+            if attempt:
+                # copy again from the start
+                self._partial.discard(name)
+            part, offset, digests = self._partial.start(name, st, algorithms)
+            if offset:
+                self._print('Resuming copy of {0} at {1}'.format(name, format_size(offset)))
+
+            def checkpoint(copied):
+                self._partial.checkpoint(name, st, copied,
+                                         digests[0].copy().hexdigest() if hashed else None)
+
+            copy_file(src, part, progress.update, fsync=True, digests=digests,
+                      offset=offset, checkpoint=checkpoint)
+            if expected is None or digests[-1].hexdigest() == expected[1]:
+                break
+            print('Checksum mismatch for {0} (attempt {1} of {2})'.format(
+                name, attempt + 1, VERIFY_ATTEMPTS))
+        else:
+            self._partial.finish(name, dst)
+            progress.finish_file()
+            return False
+        self._partial.finish(name, dst)
+        progress.finish_file()
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+        if self._store is not None and not self._store.add(dst, digests[0].hexdigest()):
+            print('No hardlinks on the video directory filesystem, dedup disabled.')
+            self._store = None
+        manifest.record(name, st, dst, digests[0].hexdigest() if hashed else None)
+        self._announce(dst)
+        return True
+
+    def _list_media(self, path):
+        files = []
+        for x in sorted(os.listdir(path)):
+            if x[0] != '.' and self._is_media(x):
+                src = '{0}/{1}'.format(path.rstrip('/'), x)
+                files.append((src, x, os.path.getsize(src)))
+        return files
+
+    def _eviction_order(self, names, manifest):
+        """Return names in the order they are evicted, see eviction_order()."""
+        added = {name: manifest.entries.get(name, {}).get('added', 0) for name in names}
+        if self._eviction != 'least_recently_played':
+            return eviction_order(names, added, {}, self._eviction)
+        paths = {}
+        for name in names:
+            # played from the video directory or, while it was being copied,
+            # from the staging directory
+            paths[name] = [os.path.join(os.path.abspath(directory), name)
+                           for directory in (self._target_path, self._staging.path)]
+        try:
+            history = PlayHistory(os.path.join(self._state_dir, 'play_history.sqlite'))
+            try:
+                played = history.last_played(p for name in names for p in paths[name])
+            finally:
+                history.close()
+        except Exception as e:
+            print('Reading play history failed: {0}'.format(e))
+            played = {}
+        return eviction_order(names, added,
+                              {name: [played.get(p, 0) for p in paths[name]] for name in names},
+                              self._eviction)
+
+    def _plan_space(self, files, dropped, manifest):
+        """Check that the files to copy fit on the SD card, evicting files of
+        the video directory if the policy allows it.  While copying in the
+        background the video directory is played and stays untouched until
+        the swap, evicted files are only left out of the staging directory.
+        """
+        # hardlinks from the content store don't keep the data of a file
+        links = 2 if self._store is not None else 1
+        dropped_bytes = 0
+        library = 0
+        candidates = []
+        for name in os.listdir(self._target_path):
+            path = os.path.join(self._target_path, name)
+            if not self._is_media(name) or not os.path.isfile(path):
+                continue
+            if name in dropped:
+                dropped_bytes += freed_bytes(path, links)
+            else:
+                library += os.path.getsize(path)
+                candidates.append(name)
+        if self._eviction == 'none':
+            candidates = []
+        candidates = [(name, os.path.getsize(os.path.join(self._target_path, name)),
+                       freed_bytes(os.path.join(self._target_path, name), links))
+                      for name in self._eviction_order(candidates, manifest)]
+        available = available_bytes(os.path.dirname(os.path.abspath(self._target_path)),
+                                    self._min_free)
+        return plan_space(sum(size for _, _, size in files), available, dropped_bytes,
+                          library, candidates, self._max_size,
+                          can_free_first=not self._background)
+
+    def _free_space(self, names, manifest):
+        """Delete files from the video directory right away, to make room
+        for the copy.
+        """
+        for name in names:
+            try:
+                os.remove(os.path.join(self._target_path, name))
+            except FileNotFoundError:
+                pass
+            manifest.remove(name)
+        manifest.save()
+        if self._store is not None:
+            self._store.collect()
+
+    def _drive_copy_mode(self, path):
+        """Return (mode, info) to copy from the drive at path with instead of
+        the configured or overridden mode, None to keep it.
+        """
+        return None
+
     def _copy_files(self, paths):
-        self._clear_screen()
+        """Put the new content together in the staging directory, next to the
+        target path, and swap it in once it is complete.  Returns true if the
+        target path changed.
+        """
+        if not self._background:
+            self._clear_screen()
+        manifest = Manifest(self._target_path)
+        # Names of the current files that are not taken over and the files
+        # to copy from the drives.
+        dropped = set()
+        files = []
+        checksums = {}
+        playlist_files = []
 
         copy_mode = self._copy_mode
         copy_mode_info = "(from config)"
@@ -76,46 +370,122 @@ class USBDriveReaderCopy(object):
                 if not self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), self._password)):
                     continue
 
-            #override copymode?
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')):
-                copy_mode = "replace"
+            #override copymode? (more than one marker file is ambiguous)
+            overrides = [mode for mode in ('replace', 'add', 'sync')
+                         if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), mode))]
+            if len(overrides) == 1:
+                copy_mode = overrides[0]
                 copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
-                copy_mode = "add"
-                copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')) \
-                    and self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
+            elif overrides:
                 copy_mode = self._copy_mode
                 copy_mode_info = "(from config)"
 
-            #inform about copymode
-            self._draw_info_text("Mode: " + copy_mode + " " + copy_mode_info)
-
-            if copy_mode == "replace":
-                # iterate over target path for deleting:
-                for x in os.listdir(self._target_path):
-                    if x[0] is not '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                        os.remove('{0}/{1}'.format(self._target_path.rstrip('/'), x))
+            # the reader may decide for a drive (see usb_drive_auto)
+            mode, mode_info = self._drive_copy_mode(path) or (copy_mode, copy_mode_info)
 
-            # iterate over source path for copying:
-            for x in os.listdir(path):
-                if x[0] is not '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                    #copy file
-                    self._copy_with_progress('{0}/{1}'.format(path.rstrip('/'), x), '{0}/{1}'.format(self._target_path.rstrip('/'), x))
+            #inform about copymode
+            self._info("Mode: " + mode + " " + mode_info)
+
+            if mode == "sync":
+                # only new and changed files are copied and only files that
+                # are gone from the drive are deleted
+                plan = plan_sync(path, self._target_path, self._is_media, manifest, self._sync_hash)
+                self._info("Sync: {0} to copy ({1}), {2} to delete, {3} unchanged".format(
+                    len(plan.copy), format_size(plan_bytes(plan)), len(plan.delete), plan.unchanged))
+                if not self._background:
+                    time.sleep(3)
+                dropped.update(plan.delete)
+                new_files = plan.copy
+            else:
+                if mode == "replace":
+                    dropped.update(x for x in os.listdir(self._target_path) if self._is_media(x))
+                    files = []
+                new_files = self._list_media(path)
+            # files with the same name are overwritten
+            new_names = set(name for _, name, _ in new_files)
+            dropped.update(new_names)
+
+            # copy in playlist order, so playback can start with the first
+            # files while the others are still copied
+            playlist_file = self._playlist_file(path)
+            if playlist_file is not None:
+                new_files = self._playlist_order(new_files, playlist_file)
+                if self._playlist_path and playlist_file == os.path.join(path, self._playlist_path):
+                    playlist_files.append(playlist_file)
+            files = [f for f in files if f[1] not in new_names] + new_files
+
+            # expected hashes from a B2SUMS or SHA256SUMS file on the drive
+            if self._verify:
+                algorithm, sums = read_checksums(path)
+                for src, name, _ in new_files:
+                    if name in sums:
+                        checksums[src] = (algorithm, sums[name])
 
             #copy loader image
             if self._copyloader:
                 loader_file_path = '{0}/{1}'.format(path.rstrip('/'), 'loader.png')
                 if os.path.exists(loader_file_path):
-                    self._clear_screen()
-                    self._draw_info_text("Copying splashscreen file...")
-                    time.sleep(2)
+                    if not self._background:
+                        self._clear_screen()
+                        self._draw_info_text("Copying splashscreen file...")
+                        time.sleep(2)
                     self._copy_with_progress(loader_file_path,'/home/pi/loader.png')
-                    
-    def _draw_copy_progress(self, copied, total):
-        perc = 100 * copied / total
-        assert (isinstance(perc, float))
-        assert (0. <= perc <= 100.)
+
+        if not dropped and not files and not playlist_files:
+            return False
+
+        # make sure the copy fits before starting it
+        plan = self._plan_space(files, dropped, manifest)
+        if not plan.fits:
+            hint = " Copying without background mode can replace files." \
+                if self._background else ""
+            self._info("Not enough space: {0} needed, {1} free. Nothing was copied.{2}".format(
+                format_size(plan.needed), format_size(plan.available), hint))
+            if not self._background:
+                time.sleep(5)
+            return False
+        if plan.evict:
+            self._info("Removing {0} file(s) to make room: {1}".format(
+                len(plan.evict), ", ".join(plan.evict)))
+            dropped.update(plan.evict)
+        if plan.free_first:
+            self._free_space([name for name in dropped if self._is_media(name)], manifest)
+        self._staging.prepare(lambda name: name not in dropped and name != MANIFEST_NAME)
+        try:
+            staged = Manifest(self._staging.path)
+            staged.entries = {name: entry for name, entry in manifest.entries.items()
+                              if name not in dropped}
+            staged.save()
+            if self._store is not None:
+                self._store.load(self._staging.path, staged.entries)
+            for playlist_file in playlist_files:
+                # the configured playlist goes along with the files, replacing
+                # (not writing through the hardlink of) the current one
+                staged_playlist = os.path.join(self._staging.path, self._playlist_path)
+                os.makedirs(os.path.dirname(staged_playlist), exist_ok=True)
+                copy_file(playlist_file, staged_playlist + '.part', fsync=True)
+                os.replace(staged_playlist + '.part', staged_playlist)
+            failed = self._copy_batch(files, staged, self._staging.path, checksums)
+            for name in failed:
+                self._staging.quarantine(name)
+            self._staging.commit()
+            # what is left over belongs to drives that were not seen again
+            self._partial.clear()
+        except BaseException:
+            self._staging.discard()
+            raise
+        finally:
+            if self._store is not None:
+                # objects of replaced and deleted files
+                self._store.collect()
+        if failed:
+            self._info("Corrupted files not copied: " + ", ".join(failed))
+            if not self._background:
+                time.sleep(3)
+        return True
+
+    def _draw_copy_progress(self, progress):
+        perc = 100 * progress.fraction
 
         progressrect =  pygame.Rect((self.screenwidth / 2) - (self.pwidth / 2) + self.borderthickness,
                                                                 (self.screenheight / 2) - (self.pheight / 2) + self.borderthickness,
@@ -129,13 +499,18 @@ class USBDriveReaderCopy(object):
         pygame.draw.rect(self._screen, self._fgcolor, progressrect)
         #progress_text
         self.draw_progress_text(str(int(round(perc)))+"%")
-
-        pygame.display.update(self.borderrect)
+        #file count and throughput, updates the display
+        self._draw_info_text("File {0}/{1} - {2} of {3} - {4}/s".format(
+            progress.file_index, progress.total_files, format_size(progress.copied_bytes),
+            format_size(progress.total_bytes), format_size(progress.bytes_per_second)))
 
     def _draw_info_text(self, message):
         label1 = self._font.render(message, True, self._fontcolor, self._bgcolor)
         l1w, l1h = label1.get_size()
-        self._screen.blit(label1, (self.screenwidth / 2 - l1w / 2, self.screenheight / 2 - l1h - self.pheight/2 - 3*self.borderthickness))
+        top = self.screenheight / 2 - l1h - self.pheight/2 - 3*self.borderthickness
+        # clear the line, the previous text might have been longer
+        self._screen.fill(self._bgcolor, pygame.Rect(0, top, self.screenwidth, l1h))
+        self._screen.blit(label1, (self.screenwidth / 2 - l1w / 2, top))
         pygame.display.update()
 
     def draw_progress_text(self, progress):
@@ -155,75 +530,153 @@ class USBDriveReaderCopy(object):
     def check_file_exists(self,file):
         return (glob.glob(file + ".*") + glob.glob(file)) != []
 
-    def _copyfile(self, src, dst, *, follow_symlinks=True):
-        """Copy data from src to dst.
+    def _copy_with_progress(self, src, dst):
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
 
-        If follow_symlinks is not set and src is a symbolic link, a new
-        symlink will be created instead of copying the file it points to.
+        progress = self._new_progress(os.path.getsize(src), 1)
+        progress.start_file(os.path.basename(src))
+        # copy next to it and rename, so dst is never incomplete
+        temp_path = os.path.join(os.path.dirname(dst), '.' + os.path.basename(dst) + '.part')
+        copy_file(src, temp_path, progress.update, fsync=True)
+        os.replace(temp_path, dst)
+        progress.finish_file()
+        progress.finish()
+        return dst
 
+    def _poll_drives(self):
+        """Note the partitions that were added.  Returns true if there are
+        new ones to copy from.
         """
-        if shutil._samefile(src, dst):
-            raise shutil.SameFileError("{!r} and {!r} are the same file".format(src, dst))
-
-        for fn in [src, dst]:
-            try:
-                st = os.stat(fn)
-            except OSError:
-                # File most likely does not exist
-                pass
-            else:
-                # XXX What about other special files? (sockets, devices...)
-                if shutil.stat.S_ISFIFO(st.st_mode):
-                    raise shutil.SpecialFileError("`%s` is a named pipe" % fn)
-
-        if not follow_symlinks and os.path.islink(src):
-            os.symlink(os.readlink(src), dst)
+        for change in self._mounter.poll_changes():
+            self._drive_changed(change)
+        if self._pending_nodes is None:
+            return True
+        now = time.monotonic()
+        return any(self._mount_retries.get(node, (now, None))[0] <= now
+                   for node in self._pending_nodes)
+
+    def _drive_changed(self, change):
+        """Handle a DriveChange from the mounter."""
+        if self._pending_nodes is None:
+            return
+        if change.action == 'add':
+            self._pending_nodes.add(change.node)
         else:
-            size = os.stat(src).st_size
-            with open(src, 'rb') as fsrc:
-                with open(dst, 'wb') as fdst:
-                    self._copyfileobj(fsrc, fdst, callback=self._draw_copy_progress, total=size)
-        return dst
-
-    def _copyfileobj(self, fsrc, fdst, callback, total, length=16 * 1024):
-        copied = 0
-        while True:
-            buf = fsrc.read(length)
-            if not buf:
-                break
-            fdst.write(buf)
-            copied += len(buf)
-            callback(copied, total=total)
-
-    def _copy_with_progress(self, src, dst, *, follow_symlinks=True):
-        if os.path.isdir(dst):
-            dst = os.path.join(dst, os.path.basename(src))
+            self._pending_nodes.discard(change.node)
+            self._mount_retries.pop(change.node, None)
 
-        # clear screen before copying
-        self._clear_screen(False)
+    def _take_pending_paths(self):
+        """Mount the drives and return the mount points of the ones that were
+        not copied from yet.
+        """
+        nodes = self._mounter.mount_all()
+        if self._pending_nodes is not None:
+            nodes = [node for node in nodes if node in self._pending_nodes]
+        self._pending_nodes = set()
+        paths = []
+        now = time.monotonic()
+        for node in nodes:
+            path = self._mounter.mount_path(node)
+            if path is not None:
+                self._mount_retries.pop(node, None)
+                paths.append(path)
+                continue
+            # Failed to mount, try again later.
+            _, delay = self._mount_retries.get(node, (None, MOUNT_RETRY_DELAY / 2))
+            delay = min(delay * 2, MOUNT_RETRY_MAX_DELAY)
+            self._mount_retries[node] = (now + delay, delay)
+            self._pending_nodes.add(node)
+        return paths
+
+    def _start_copy(self):
+        """Mount the new drives and copy from them in a background thread."""
+        self._worker = threading.Thread(target=self._copy_worker,
+                                        args=(self._take_pending_paths(),),
+                                        daemon=True)
+        self._worker.start()
+
+    def _copy_worker(self, paths):
+        try:
+            swapped = self._copy_files(paths)
+        except Exception as e:
+            print('Copying from USB drive failed: {0}'.format(e))
+            # files that were announced are gone with the staging directory
+            swapped = True
+        else:
+            if swapped:
+                self._print('Copying finished, new files are in place.')
+        self._copy_swapped = self._copy_swapped or swapped
+        os.write(self._wakeup_w, b'x')
 
-        self._copyfile(src, dst, follow_symlinks=follow_symlinks)
-        # shutil.copymode(src, dst)
-        return dst
+    def _copying(self):
+        return self._worker is not None and self._worker.is_alive()
 
     def search_paths(self):
         """Return a list of paths to search for files. Will return a list of all
         mounted USB drives.
         """
-        if(self._mounter.has_nodes()):
-            self._mounter.mount_all()
-            self._copy_files(glob.glob(self._mount_path + '*'))
+        if self._background:
+            # Drives present at startup are copied from in the background,
+            # later ones when is_changed() sees them.
+            if self._first_search and self._mounter.has_nodes():
+                self._start_copy()
+            self._first_search = False
+        elif self._mounter.has_nodes():
+            paths = self._take_pending_paths()
+            if paths:
+                self._copy_files(paths)
 
         return [self._target_path]
 
     def is_changed(self):
         """Return true if the file search paths have changed, like when a new
-        USB drive is inserted.
+        USB drive is inserted.  When copying in the background this is only
+        the case once new files were copied and swapped in.
         """
-        if self._mounter.poll_changes() and self._mounter.has_nodes():
+        if not self._background:
+            return self._poll_drives() and self._mounter.has_nodes()
+
+        try:
+            while os.read(self._wakeup_r, 64):
+                pass
+        except BlockingIOError:
+            pass
+        if self._poll_drives() and not self._copying() and self._mounter.has_nodes():
+            # drives added during a copy are copied from after it
+            self._start_copy()
+        if self._copy_swapped and not self._copying():
+            self._copy_swapped = False
             return True
-        else:
-            return False
+        return False
+
+    def poll_additions(self):
+        """Return the paths of the files a background copy completed since
+        the last call.  They are in the staging directory until the copy is
+        done, when is_changed() reports the move to the target path.
+        """
+        with self._additions_lock:
+            additions = self._additions
+            self._additions = []
+        return additions
+
+    def is_soft_change(self):
+        """Background copies only replace the library the player is already
+        playing from, so the playlist can be updated without stopping.
+        """
+        return self._background
+
+    def fileno(self):
+        """Return a file descriptor that becomes readable on drive changes
+        and when a background copy finished.
+        """
+        return self._epoll.fileno()
+
+    def next_timeout(self):
+        """Return the seconds until mounting a drive is tried again."""
+        if not self._mount_retries:
+            return None
+        return max(0, min(due for due, _ in self._mount_retries.values()) - time.monotonic())
 
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
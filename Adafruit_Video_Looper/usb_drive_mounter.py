@@ -1,15 +1,61 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
+import collections
+import ctypes
 import glob
+import os
+import re
 import subprocess
 import time
 
 import pyudev
 
+# mount(2) flags and umount2(2) flag from <sys/mount.h>.
+MS_RDONLY = 1
+MS_NOSUID = 2
+MS_NODEV = 4
+MS_NOATIME = 1024
+MNT_DETACH = 2
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong,
+                        ctypes.c_char_p]
+_libc.umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+
+DriveChange = collections.namedtuple('DriveChange', 'action node path')
+DriveChange.__doc__ = """A USB drive partition that was added or removed.  action is 'add' or
+'remove', node the device node (like /dev/sda1) and path where it is
+mounted, None if it is not (yet)."""
+
+
+def _mount_points():
+    """Return the set of paths something is mounted at."""
+    points = set()
+    try:
+        with open('/proc/self/mountinfo', 'rb') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 4:
+                    # spaces and other special characters are octal escapes
+                    points.add(os.fsdecode(re.sub(
+                        rb'\\([0-7]{3})', lambda m: bytes([int(m.group(1), 8)]), fields[4])))
+    except OSError:
+        pass
+    return points
+
+
+def _is_usb_partition(device):
+    return device.get('ID_BUS') == 'usb' and device.device_node is not None
+
 
 class USBDriveMounter:
-    """Service for automatically mounting attached USB drives."""
+    """Service for automatically mounting attached USB drives.
+
+    Keeps a map of the attached partitions to their mount points, which udev
+    events update.  Only partitions that were added or removed get mounted or
+    unmounted, drives that stay attached are never touched.
+    """
 
     def __init__(self, root='/mnt/usbdrive', readonly=True):
         """Create an instance of the USB drive mounter service.  Root is an
@@ -21,66 +67,146 @@ class USBDriveMounter:
         self._root = root
         self._readonly = readonly
         self._context = pyudev.Context()
+        self._monitor = None
+        # node -> filesystem type of the attached partitions
+        self._nodes = None
+        # node -> mount point of the partitions mounted by us
+        self._mounts = {}
+
+    def _enumerate(self):
+        """Return node -> filesystem type of the attached USB partitions."""
+        return {x.device_node: x.get('ID_FS_TYPE')
+                for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
+                if _is_usb_partition(x)}
+
+    def _attached(self):
+        if self._nodes is None:
+            self._nodes = self._enumerate()
+        return self._nodes
+
+    def _free_path(self):
+        used = set(self._mounts.values())
+        index = 0
+        while self._root + str(index) in used:
+            index += 1
+        return self._root + str(index)
+
+    def _mount(self, node, fs_type):
+        """Mount a partition at the next free mount point, returns it."""
+        path = self._free_path()
+        os.makedirs(path, exist_ok=True)
+        flags = MS_NOATIME | MS_NOSUID | MS_NODEV | (MS_RDONLY if self._readonly else 0)
+        if fs_type is None or _libc.mount(os.fsencode(node), os.fsencode(path),
+                                          os.fsencode(fs_type), flags, None) != 0:
+            # Unknown type or a filesystem that needs a helper (exfat and ntfs
+            # through FUSE), mount(8) knows what to do.
+            options = 'noatime,nosuid,nodev' + (',ro' if self._readonly else '')
+            subprocess.check_call(['mount', '-o', options, node, path])
+        self._mounts[node] = path
+        return path
+
+    def _unmount(self, path):
+        """Lazily unmount path (the drive might be gone already) and remove
+        the mount point.
+        """
+        if _libc.umount2(os.fsencode(path), MNT_DETACH) != 0:
+            subprocess.call(['umount', '-l', path], stderr=subprocess.DEVNULL)
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
 
     def remove_all(self):
         """Unmount and remove mount points for all mounted drives."""
+        mounted = _mount_points()
         for path in glob.glob(self._root + '*'):
-            subprocess.call(['umount', '-l', path])
-            subprocess.call(['rm', '-r', path])
+            if os.path.realpath(path) in mounted:
+                self._unmount(path)
+            else:
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+        self._mounts = {}
 
     def mount_all(self):
-        """Mount all attached USB drives.  Readonly is a boolean that specifies
-        if the drives should be mounted read only (defaults to true).
+        """Mount the attached USB drives that are not mounted yet and unmount
+        the ones that are gone.  Returns the list of attached partitions.
         """
-        self.remove_all()
-        # Enumerate USB drive partitions by path like /dev/sda1, etc.
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        # Mount each drive under the mount root.
-        for i, node in enumerate(nodes):
-            path = self._root + str(i)
-            subprocess.call(['mkdir', path])
-            args = ['mount']
-            if self._readonly:
-                args.append('-r')
-            args.extend([node, path])
-            subprocess.check_call(args)
-
-        return nodes
+        attached = self._attached()
+        if not self._mounts:
+            # Leftovers of an earlier run.
+            self.remove_all()
+        for node in [node for node in self._mounts if node not in attached]:
+            self._unmount(self._mounts.pop(node))
+        for node in sorted(attached):
+            if node not in self._mounts:
+                try:
+                    self._mount(node, attached[node])
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print('Mounting {0} failed: {1}'.format(node, e))
+        return sorted(attached)
+
+    def mount_path(self, node):
+        """Return where a partition is mounted, None if it isn't."""
+        return self._mounts.get(node)
 
     def has_nodes(self):
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        return nodes != []
+        return bool(self._attached())
 
     def start_monitor(self):
         """Initialize monitoring of USB drive changes."""
         self._monitor = pyudev.Monitor.from_netlink(self._context)
         self._monitor.filter_by('block', 'partition')
         self._monitor.start()
+        # Enumerate after the monitor runs so no change is missed between.
+        self._nodes = self._enumerate()
+
+    def fileno(self):
+        """Return the udev netlink socket, readable when a drive changed."""
+        return self._monitor.fileno()
 
     def poll_changes(self):
-        """Check for changes to USB drives.  Returns true if there was a USB 
-        drive change, otherwise false.
+        """Check for changes to USB drives.  Returns a list of DriveChange,
+        empty if nothing changed.  Removed partitions are unmounted right
+        away, added ones get mounted by the next mount_all().
         """
-        # Look for a drive change.
-        device = self._monitor.poll(0)
-        # If a USB drive changed (added/remove) remount all drives.
-        if device is not None and device['ID_BUS'] == 'usb':
-            return True
-        # Else nothing changed.
-        return False
+        attached = self._attached()
+        changes = []
+        while True:
+            device = self._monitor.poll(0)
+            if device is None:
+                break
+            if not _is_usb_partition(device):
+                continue
+            node = device.device_node
+            fs_type = device.get('ID_FS_TYPE')
+            # A change event without a filesystem means the medium is gone
+            # (card readers), one with a filesystem that it was inserted.
+            if device.action == 'remove' or (device.action == 'change' and fs_type is None):
+                if node not in attached:
+                    continue
+                del attached[node]
+                path = self._mounts.pop(node, None)
+                if path is not None:
+                    self._unmount(path)
+                changes.append(DriveChange('remove', node, path))
+            elif device.action in ('add', 'change') and node not in attached:
+                attached[node] = fs_type
+                changes.append(DriveChange('add', node, None))
+        return changes
 
 
 if __name__ == '__main__':
     # Run as a service that mounts all USB drives as read-only under the default
     # path of /mnt/usbdrive*.
     drive_mounter = USBDriveMounter(readonly=True)
-    drive_mounter.mount_all()
     drive_mounter.start_monitor()
+    drive_mounter.mount_all()
     print ('Listening for USB drive changes (press Ctrl-C to quit)...')
     while True:
-        if drive_mounter.poll_changes():
-            print ('USB drives changed!')
+        changes = drive_mounter.poll_changes()
+        if changes:
+            print ('USB drives changed: {0}'.format(changes))
             drive_mounter.mount_all()
-        time.sleep(0)
+        time.sleep(0.5)
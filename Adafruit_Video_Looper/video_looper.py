@@ -17,8 +17,13 @@ from datetime import datetime
 import RPi.GPIO as GPIO
 
 from .alsa_config import parse_hw_device
+from .event_waiter import EventWaiter
+from .library_scanner import LibraryScanner
+from .media_index import MediaIndex
 from .model import Playlist, Movie
+from .play_history import PlayHistory
 from .playlist_builders import build_playlist_m3u
+from .state_store import StateStore
 
 
 # Basic video looper architecure:
@@ -44,6 +49,30 @@ from .playlist_builders import build_playlist_m3u
 # - Future file readers and video players can be provided and referenced in the
 #   config to extend the video player use to read from different file sources
 #   or use different video players.
+#
+# - The main loop does not poll.  It sleeps in an EventWaiter until a player
+#   process exits (SIGCHLD), an input thread posts a command or one of the
+#   optional hooks of the reader/player fires.  Readers and players may define
+#   fileno() returning a file descriptor that becomes readable when is_changed()
+#   or is_playing() might have changed, and next_timeout() returning the seconds
+#   until they need to be checked again (None if only events matter).  Readers
+#   may also define is_file_ready(path) to hold back files that are still
+#   being written, poll_additions() returning paths of files that became
+#   playable since the last call (they are appended to the playlist without
+#   a rebuild) and is_soft_change() returning true if the change is_changed()
+#   reported can be applied without stopping what is playing.  Players may
+#   define preload(peek) to prepare the upcoming movies (peek(n) returns up to
+#   n of them, random order is drawn ahead), prepare_playlist(movies) to do
+#   the same for a whole new playlist in the background, stats() returning
+#   a dict of measurements that is printed after each play(), update() to draw
+#   (e.g. the next animation frame) and close() to end helper processes when
+#   the looper quits.  update() is only called by the main loop, is_playing()
+#   is also called by the input threads and must not draw.  Readers without a
+#   fileno(), and players if SIGCHLD can't be routed to the main loop, are
+#   polled every FALLBACK_POLL_INTERVAL seconds.
+FALLBACK_POLL_INTERVAL = 1.0
+
+
 class VideoLooper:
 
     def __init__(self, config_path):
@@ -142,6 +171,47 @@ class VideoLooper:
         self._sound_vol = 0
         # Set other static internal state.
         self._extensions = "|".join(self._player.supported_extensions())
+        self._extensions_re = re.compile(
+            "\\.({0})$".format(self._extensions), flags=re.IGNORECASE
+        )
+        self._repeat_re = re.compile("_repeat_([0-9]*)x", flags=re.IGNORECASE)
+        # Directory for persistent state like the media index.
+        self._state_dir = self._config.get("video_looper", "state_dir")
+        self._media_index = None
+        if self._config.getboolean("video_looper", "media_index"):
+            try:
+                self._media_index = MediaIndex(
+                    os.path.join(self._state_dir, "media_index.sqlite")
+                )
+            except Exception as err:
+                self._print("media index could not be opened: {0}".format(err))
+        # Position in the playlist (and in the movie, for players that can
+        # seek) to resume from after a restart.
+        self._state = None
+        self._resume_position = None
+        self._next_position_sample = 0
+        self._state_interval = self._config.getfloat("video_looper", "state_interval")
+        if self._resume_playlist:
+            self._state = StateStore(
+                os.path.join(self._state_dir, "playback_state.json"),
+                self._state_interval,
+            )
+        self._play_history = None
+        if self._config.getboolean("video_looper", "play_history"):
+            try:
+                self._play_history = PlayHistory(
+                    os.path.join(self._state_dir, "play_history.sqlite")
+                )
+            except Exception as err:
+                self._print("play history could not be opened: {0}".format(err))
+        self._scanner = LibraryScanner(
+            self._parse_media_name,
+            self._extensions,
+            max_depth=self._config.getint("video_looper", "scan_depth"),
+            exclude=self._config.get("video_looper", "scan_exclude").split(","),
+            workers=self._config.getint("video_looper", "scan_threads"),
+            media_index=self._media_index,
+        )
         self._small_font = pygame.font.Font(None, 50)
         self._medium_font = pygame.font.Font(None, 96)
         self._big_font = pygame.font.Font(None, 250)
@@ -150,6 +220,8 @@ class VideoLooper:
         self._playbackStopped = not self._play_on_startup
         # used for not waiting the first time
         self._firstStart = True
+        # wakes up the main loop on player exit, input commands and reader events
+        self._events = EventWaiter()
 
         # start keyboard handler thread:
         # Event handling for key press, if keyboard control is enabled
@@ -298,60 +370,78 @@ class VideoLooper:
                     movies_a.append(movie)
                 else:
                     movies_b.append(movie)
-            return Playlist(movies_a), Playlist(movies_b)
+            return (
+                self._attach_state(Playlist(movies_a), "playlist_a"),
+                self._attach_state(Playlist(movies_b), "playlist_b"),
+            )
+
+        return self._attach_state(playlist, "playlist")
 
+    def _attach_state(self, playlist, key):
+        """Let the playlist save its position for resume_playlist."""
+        if self._state is not None and playlist is not None:
+            playlist.attach_state(self._state, key)
         return playlist
 
+    def _parse_media_name(self, name):
+        """Return (title, repeats) for a media file name, None for other files."""
+        # Ignore hidden files (useful when file loaded on usb key from an OSX computer
+        if name[0] == "." or not self._extensions_re.search(name):
+            return None
+        repeatsetting = self._repeat_re.search(name)
+        if repeatsetting is not None and repeatsetting.group(1):
+            repeat = int(repeatsetting.group(1))
+        else:
+            repeat = 1
+        basename, extension = os.path.splitext(name)
+        return basename, repeat
+
+    def _read_first_line(self, path):
+        """Return the first line of a file or None if it does not exist."""
+        try:
+            with open(path, "r") as f:
+                return f.readline()
+        except FileNotFoundError:
+            return None
+
     def _build_playlist_from_all_files(self):
         """Search all the file reader paths for movie files with the provided
         extensions.
         """
         # Get list of paths to search from the file reader.
         paths = self._reader.search_paths()
-        # Enumerate all movie files inside those paths.
+        # Readers can hold back files that are still being written.
+        is_file_ready = getattr(self._reader, "is_file_ready", None)
+        # Enumerate all movie files inside those paths, results are streamed
+        # by the scanner while it walks the paths in parallel.
         movies = []
+        for entry in self._scanner.scan(paths):
+            if is_file_ready is not None and not is_file_ready(entry.path):
+                self._print("Skipping {0}, still being written".format(entry.path))
+                continue
+            movies.append(Movie(entry.path, entry.title, entry.repeats))
+        self._print("Library scan: {0}".format(self._scanner.stats))
+
         for path in paths:
             # Skip paths that don't exist or are files.
             if not os.path.exists(path) or not os.path.isdir(path):
                 continue
 
-            for x in os.listdir(path):
-                # Ignore hidden files (useful when file loaded on usb key from an OSX computer
-                if x[0] != "." and re.search(
-                    "\.({0})$".format(self._extensions), x, flags=re.IGNORECASE
-                ):
-                    repeatsetting = re.search(
-                        "_repeat_([0-9]*)x", x, flags=re.IGNORECASE
-                    )
-                    if repeatsetting is not None:
-                        repeat = repeatsetting.group(1)
-                    else:
-                        repeat = 1
-                    basename, extension = os.path.splitext(x)
-                    movies.append(
-                        Movie("{0}/{1}".format(path.rstrip("/"), x), basename, repeat)
-                    )
-
             # Get the ALSA hardware volume from the file in the usb key
             if self._alsa_hw_vol_file:
-                alsa_hw_vol_file_path = "{0}/{1}".format(
-                    path.rstrip("/"), self._alsa_hw_vol_file
+                alsa_hw_vol_string = self._read_first_line(
+                    "{0}/{1}".format(path.rstrip("/"), self._alsa_hw_vol_file)
                 )
-                if os.path.exists(alsa_hw_vol_file_path):
-                    with open(alsa_hw_vol_file_path, "r") as alsa_hw_vol_file:
-                        alsa_hw_vol_string = alsa_hw_vol_file.readline()
-                        self._alsa_hw_vol = alsa_hw_vol_string
+                if alsa_hw_vol_string is not None:
+                    self._alsa_hw_vol = alsa_hw_vol_string
 
             # Get the video volume from the file in the usb key
             if self._sound_vol_file:
-                sound_vol_file_path = "{0}/{1}".format(
-                    path.rstrip("/"), self._sound_vol_file
+                sound_vol_string = self._read_first_line(
+                    "{0}/{1}".format(path.rstrip("/"), self._sound_vol_file)
                 )
-                if os.path.exists(sound_vol_file_path):
-                    with open(sound_vol_file_path, "r") as sound_file:
-                        sound_vol_string = sound_file.readline()
-                        if self._is_number(sound_vol_string):
-                            self._sound_vol = int(float(sound_vol_string))
+                if sound_vol_string is not None and self._is_number(sound_vol_string):
+                    self._sound_vol = int(float(sound_vol_string))
         # Create a playlist with the sorted list of movies.
         return Playlist(sorted(movies))
 
@@ -404,7 +494,9 @@ class VideoLooper:
             )
             pygame.display.update()
             # Pause for a second between each frame.
-            time.sleep(1)
+            self._wait(1)
+            if not self._running:
+                return
 
     def _display_datetime(self):
         # returns suffix based on the day
@@ -459,7 +551,8 @@ class VideoLooper:
                 self._screen.blit(bottom_label, (bottom_x, bottom_y))
                 pygame.display.update()
 
-                time.sleep(1)
+                if not self._wait(1):
+                    break
 
     def _idle_message(self):
         """Print idle message from file reader."""
@@ -505,6 +598,8 @@ class VideoLooper:
         if playlist_b:
             length += playlist_b.length()
         if length > 0:
+            if hasattr(self._player, "prepare_playlist"):
+                self._player.prepare_playlist(playlist.movies)
             self._animate_countdown(playlist, playlist_b)
             self._blank_screen()
         else:
@@ -539,38 +634,28 @@ class VideoLooper:
                 # If pressed key is ESC quit program
                 if event.key == pygame.K_ESCAPE:
                     self._print("ESC was pressed. quitting...")
-                    self.quit()
+                    self._events.post("quit", False)
                 if event.key == pygame.K_k:
                     self._print("k was pressed. skipping...")
-                    self._playlist.seek(1)
-                    self._player.stop(3)
-                    self._playbackStopped = False
+                    self._events.post("seek", 1)
                 if event.key == pygame.K_s:
-                    if self._playbackStopped:
-                        self._print("s was pressed. starting...")
-                        self._playbackStopped = False
-                    else:
-                        self._print("s was pressed. stopping...")
-                        self._playbackStopped = True
-                        self._player.stop(3)
+                    self._events.post("toggle_stop")
                 # space is pause/resume the playing video
                 if event.key == pygame.K_SPACE:
                     self._print("Pause/Resume pressed")
-                    self._player.pause()
+                    self._events.post("pause")
                 if event.key == pygame.K_p:
                     self._print("p was pressed. shutting down...")
-                    self.quit(True)
+                    self._events.post("quit", True)
                 if event.key == pygame.K_b:
                     self._print("b was pressed. jumping back...")
-                    self._playlist.seek(-1)
-                    self._player.stop(3)
-                    self._playbackStopped = False
+                    self._events.post("seek", -1)
                 if event.key == pygame.K_o:
                     self._print("o was pressed. next chapter...")
-                    self._player.sendKey("o")
+                    self._events.post("key", "o")
                 if event.key == pygame.K_i:
                     self._print("i was pressed. previous chapter...")
-                    self._player.sendKey("i")
+                    self._events.post("key", "i")
 
     def _handle_gpio_control(self, pin):
         if self._pinMap == None:
@@ -589,9 +674,198 @@ class VideoLooper:
                 pygame.event.Event(pygame.KEYDOWN, key=getattr(pygame, action, None))
             )
         else:
-            self._playlist.set_next(action)
-            self._player.stop(3)
-            self._playbackStopped = False
+            self._events.post("jump", action)
+
+    def _playlists(self):
+        """Return the playlists that are currently loaded."""
+        if self._is_dualscreen:
+            playlists = [self._playlist_a, self._playlist_b]
+        else:
+            playlists = [self._playlist]
+        return [playlist for playlist in playlists if playlist is not None]
+
+    def _process_commands(self, commands):
+        """Execute commands posted by the input threads in the main thread.
+        Returns true if one of them changed what should be playing.
+        """
+        interrupted = False
+        for command, args in commands:
+            if command == "quit":
+                self.quit(*args)
+                interrupted = True
+            elif command in ("seek", "jump"):
+                for playlist in self._playlists():
+                    if command == "seek":
+                        playlist.seek(args[0])
+                    else:
+                        playlist.set_next(args[0])
+                self._player.stop(3)
+                self._playbackStopped = False
+                interrupted = True
+            elif command == "toggle_stop":
+                if self._playbackStopped:
+                    self._print("s was pressed. starting...")
+                    self._playbackStopped = False
+                else:
+                    self._print("s was pressed. stopping...")
+                    self._playbackStopped = True
+                    self._player.stop(3)
+                interrupted = True
+            elif command == "pause":
+                self._player.pause()
+            elif command == "key":
+                self._player.sendKey(args[0])
+        return interrupted
+
+    def _add_movies(self, paths):
+        """Append media files that became available to the playlist (the
+        shorter one with two screens).  Returns true if any was added.
+        """
+        added = False
+        for path in paths:
+            parsed = self._parse_media_name(os.path.basename(path))
+            if parsed is None:
+                continue
+            title, repeats = parsed
+            if self._is_dualscreen:
+                playlist = min(self._playlist_a, self._playlist_b, key=Playlist.length)
+            else:
+                playlist = self._playlist
+            playlist.add(Movie(path, title, repeats))
+            self._print("Added movie: {0}".format(path))
+            added = True
+        return added
+
+    def _update_playlists(self):
+        """Rebuild the playlist but continue after the movie that is
+        playing instead of starting over.
+        """
+        if self._is_dualscreen:
+            playlist_a, playlist_b = self._build_playlist()
+            self._playlist_a.update(playlist_a.movies)
+            self._playlist_b.update(playlist_b.movies)
+        else:
+            self._playlist.update(self._build_playlist().movies)
+
+    def _upcoming_movies(self, movie, count):
+        """Return up to count movies that are expected to play after movie."""
+        upcoming = []
+        # Players that can't count loops get the same movie again until it
+        # was played as often as requested.
+        if not self._player.can_loop_count() and movie.playcount < movie.repeats:
+            upcoming.append(movie)
+        upcoming.extend(self._playlist.peek(count, self._is_random))
+        return upcoming[:count]
+
+    def _record_play(self, movie):
+        """Add a play of movie to the play history (if it is kept)."""
+        if self._play_history is None or movie is None:
+            return
+        try:
+            self._play_history.record(os.path.abspath(movie.target))
+        except Exception as err:
+            self._print("play history write failed: {0}".format(err))
+
+    def _can_resume_position(self):
+        return (
+            self._state is not None
+            and not self._is_dualscreen
+            and hasattr(self._player, "position")
+            and hasattr(self._player, "seek")
+        )
+
+    def _load_resume_position(self):
+        """Remember where the movie that played last was stopped, before
+        the playlist starts over and overwrites it.
+        """
+        if not self._can_resume_position():
+            return
+        saved = self._state.get("playlist")
+        if isinstance(saved, dict) and saved.get("position"):
+            self._resume_position = (saved.get("movie"), saved["position"])
+
+    def _resume_movie(self, movie):
+        """Seek to the saved position if movie is the one that was stopped."""
+        if self._resume_position is None:
+            return
+        target, position = self._resume_position
+        self._resume_position = None
+        if movie.target == target:
+            self._print("Resuming {0} at {1:.1f}s".format(movie, position))
+            self._player.seek(position)
+
+    def _position_timeout(self):
+        """Return the seconds until the playback position is saved next."""
+        if not self._can_resume_position() or not self._player.is_playing():
+            return None
+        return max(0, self._next_position_sample - time.monotonic())
+
+    def _save_state(self):
+        """Sample the playback position and write the state when due."""
+        if self._state is None:
+            return
+        if self._position_timeout() == 0:
+            self._next_position_sample = time.monotonic() + self._state_interval
+            position = self._player.position()
+            if position is not None:
+                self._state.update("playlist", position=round(position, 1))
+        self._state.maybe_flush()
+
+    def _print_player_stats(self):
+        """Print the statistics the player collected, if it has any."""
+        if hasattr(self._player, "stats"):
+            stats = self._player.stats()
+            if stats:
+                self._print(
+                    "Player stats: "
+                    + ", ".join("{0}={1}".format(k, v) for k, v in stats.items())
+                )
+
+    def _wait(self, timeout):
+        """Wait up to timeout seconds while still executing input commands.
+        Returns false if a command interrupted the wait.
+        """
+        deadline = time.monotonic() + timeout
+        while self._running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            if self._process_commands(self._events.wait(remaining)):
+                return False
+        return False
+
+    def _wait_between_files(self):
+        """Honor the configured wait_time, can be interrupted by input."""
+        if self._datetime_display:
+            self._display_datetime()
+        else:
+            self._print("Waiting for: {0} seconds".format(self._wait_time))
+            self._wait(self._wait_time)
+
+    def _wait_for_events(self):
+        """Sleep until the player or reader need attention or a command arrives."""
+        fds = []
+        timeouts = []
+        for source in (self._player, self._reader):
+            fd = source.fileno() if hasattr(source, "fileno") else None
+            if fd is not None:
+                fds.append(fd)
+            elif source is self._reader:
+                timeouts.append(FALLBACK_POLL_INTERVAL)
+            if hasattr(source, "next_timeout"):
+                timeout = source.next_timeout()
+                if timeout is not None:
+                    timeouts.append(timeout)
+        if not self._events.signals_enabled and self._player.is_playing():
+            timeouts.append(FALLBACK_POLL_INTERVAL)
+        if self._state is not None:
+            for timeout in (self._state.next_timeout(), self._position_timeout()):
+                if timeout is not None:
+                    timeouts.append(timeout)
+        self._events.watch(fds)
+        self._process_commands(
+            self._events.wait(min(timeouts) if timeouts else None)
+        )
 
     def _gpio_setup(self):
         if self._pinMap == None:
@@ -618,12 +892,26 @@ class VideoLooper:
         else:
             self._playlist = self._build_playlist()
             self._prepare_to_run_playlist(self._playlist)
+            self._load_resume_position()
             movie = self._playlist.get_next(self._is_random, self._resume_playlist)
         self._set_hardware_volume()
         # Main loop to play videos in the playlist and listen for file changes.
         while self._running:
+            if hasattr(self._player, "update"):
+                self._player.update()
+
             # Load and play a new movie if nothing is playing.
             if not self._player.is_playing() and not self._playbackStopped:
+                if self._is_dualscreen:
+                    has_movie = movie_a is not None or movie_b is not None
+                else:
+                    has_movie = movie is not None
+                if self._wait_time > 0 and not self._firstStart and has_movie:
+                    self._wait_between_files()
+                    if self._playbackStopped or not self._running:
+                        continue
+                self._firstStart = False
+
                 if self._is_dualscreen:
                     if movie_a is not None and movie_a.playcount >= movie_a.repeats:
                         movie_a.clear_playcount()
@@ -641,16 +929,8 @@ class VideoLooper:
                         movie_a.was_played()
                     if movie_b is not None:
                         movie_b.was_played()
-
-                    if self._wait_time > 0 and not self._firstStart:
-                        if self._datetime_display:
-                            self._display_datetime()
-                        else:
-                            self._print(
-                                "Waiting for: {0} seconds".format(self._wait_time)
-                            )
-                            time.sleep(self._wait_time)
-                    self._firstStart = False
+                    self._record_play(movie_a)
+                    self._record_play(movie_b)
 
                     player_loop_a = -1 if self._playlist_a.length() == 1 else None
                     player_loop_b = -1 if self._playlist_b.length() == 1 else None
@@ -669,6 +949,7 @@ class VideoLooper:
                         loop_b=player_loop_b,
                         vol=self._sound_vol,
                     )
+                    self._print_player_stats()
                 else:
                     if movie is not None:  # just to avoid errors
 
@@ -684,16 +965,7 @@ class VideoLooper:
                             )
 
                         movie.was_played()
-
-                        if self._wait_time > 0 and not self._firstStart:
-                            if self._datetime_display:
-                                self._display_datetime()
-                            else:
-                                self._print(
-                                    "Waiting for: {0} seconds".format(self._wait_time)
-                                )
-                                time.sleep(self._wait_time)
-                        self._firstStart = False
+                        self._record_play(movie)
 
                         # generating infotext
                         if self._player.can_loop_count():
@@ -717,43 +989,84 @@ class VideoLooper:
                         self._print("Playing movie: {0} {1}".format(movie, infotext))
                         # todo: maybe clear screen to black so that background (image/color) is not visible for videos with a resolution that is < screen resolution
                         self._player.play(movie, loop=player_loop, vol=self._sound_vol)
+                        self._resume_movie(movie)
+                        self._print_player_stats()
+                        # Let the player prepare what comes next (e.g. a paused
+                        # standby process for gapless playback).
+                        if hasattr(self._player, "preload") and player_loop is None \
+                                and not self._one_shot_playback:
+                            self._player.preload(
+                                lambda count, current=movie: self._upcoming_movies(
+                                    current, count
+                                )
+                            )
 
-            # Check for changes in the file search path (like USB drives added)
-            # and rebuild the playlist.
-            if self._reader.is_changed() and not self._playbackStopped:
-                self._print("reader changed, stopping player")
-                self._player.stop(3)  # Up to 3 second delay waiting for old
-                # player to stop.
-                self._print("player stopped")
-                # Rebuild playlist and show countdown again (if OSD enabled).
+            # Files the reader makes available while it is still busy (like
+            # copy mode copying in the background) are played right away.
+            lengths = [playlist.length() for playlist in self._playlists()]
+            if hasattr(self._reader, "poll_additions") and self._add_movies(
+                self._reader.poll_additions()
+            ):
+                if 1 in lengths and self._player.is_playing():
+                    # A single movie loops endlessly, end it to get to the
+                    # new ones.
+                    self._player.stop(3)
                 if self._is_dualscreen:
-                    self._playlist_a, self._playlist_b = self._build_playlist()
-                    if self._copyloader:
-                        self._bgimage = self._load_bgimage()
-                    self._prepare_to_run_playlist(self._playlist_a, self._playlist_b)
-                    self._set_hardware_volume()
-                    movie_a = self._playlist_a.get_next(
-                        self._is_random, self._resume_playlist
-                    )
-                    movie_b = self._playlist_b.get_next(
-                        self._is_random, self._resume_playlist
-                    )
-                else:
-                    self._playlist = self._build_playlist()
-                    # refresh background image
-                    if self._copyloader:
-                        self._bgimage = self._load_bgimage()
-                    self._prepare_to_run_playlist(self._playlist)
-                    self._set_hardware_volume()
+                    if movie_a is None:
+                        movie_a = self._playlist_a.get_next(
+                            self._is_random, self._resume_playlist
+                        )
+                    if movie_b is None:
+                        movie_b = self._playlist_b.get_next(
+                            self._is_random, self._resume_playlist
+                        )
+                elif movie is None:
                     movie = self._playlist.get_next(
                         self._is_random, self._resume_playlist
                     )
 
-            # Give the CPU some time to do other tasks. low values increase "responsiveness to changes" and reduce the pause between files
-            # but increase CPU usage
-            # since keyboard commands are handled in a seperate thread this sleeptime mostly influences the pause between files
+            # Check for changes in the file search path (like USB drives added)
+            # and rebuild the playlist.
+            if self._reader.is_changed() and not self._playbackStopped:
+                if self._player.is_playing() and getattr(
+                    self._reader, "is_soft_change", lambda: False
+                )():
+                    self._print("reader changed, updating playlist")
+                    self._update_playlists()
+                else:
+                    self._print("reader changed, stopping player")
+                    self._player.stop(3)  # Up to 3 second delay waiting for old
+                    # player to stop.
+                    self._print("player stopped")
+                    # Rebuild playlist and show countdown again (if OSD enabled).
+                    if self._is_dualscreen:
+                        self._playlist_a, self._playlist_b = self._build_playlist()
+                        if self._copyloader:
+                            self._bgimage = self._load_bgimage()
+                        self._prepare_to_run_playlist(self._playlist_a, self._playlist_b)
+                        self._set_hardware_volume()
+                        movie_a = self._playlist_a.get_next(
+                            self._is_random, self._resume_playlist
+                        )
+                        movie_b = self._playlist_b.get_next(
+                            self._is_random, self._resume_playlist
+                        )
+                    else:
+                        self._playlist = self._build_playlist()
+                        # refresh background image
+                        if self._copyloader:
+                            self._bgimage = self._load_bgimage()
+                        self._prepare_to_run_playlist(self._playlist)
+                        self._set_hardware_volume()
+                        movie = self._playlist.get_next(
+                            self._is_random, self._resume_playlist
+                        )
+
+            self._save_state()
 
-            time.sleep(0.002)
+            # Sleep until the player exits, the reader reports a change or a
+            # command arrives instead of polling.
+            self._wait_for_events()
 
         self._print("run ended")
         pygame.quit()
@@ -771,6 +1084,29 @@ class VideoLooper:
 
         if self._player is not None:
             self._player.stop()
+            # Let players end their helpers (like render workers).
+            if hasattr(self._player, "close"):
+                self._player.close()
+
+        if self._state is not None:
+            try:
+                self._state.flush()
+            except OSError as err:
+                self._print("playback state could not be saved: {0}".format(err))
+
+        if self._play_history is not None:
+            try:
+                self._play_history.close()
+            except Exception as err:
+                self._print("play history could not be saved: {0}".format(err))
+            self._play_history = None
+
+        if self._media_index is not None:
+            try:
+                self._media_index.close()
+            except Exception as err:
+                self._print("media index could not be closed: {0}".format(err))
+            self._media_index = None
 
         if self._pinMap:
             GPIO.cleanup()
@@ -12,7 +12,7 @@ fi
 
 echo "Installing dependencies..."
 echo "=========================="
-apt update && apt -y install python3 python3-pip python3-pygame supervisor omxplayer ntfs-3g exfat-fuse
+apt update && apt -y install python3 python3-pip python3-pygame python3-pil supervisor omxplayer ntfs-3g exfat-fuse
 
 if [ "$*" != "no_hello_video" ]
 then
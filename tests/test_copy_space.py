@@ -0,0 +1,74 @@
+import unittest
+
+from Adafruit_Video_Looper.copy_space import eviction_order, plan_space
+
+
+class EvictionOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.added = {'a.mp4': 10, 'b.mp4': 20, 'c.mp4': 30}
+
+    def test_oldest_added(self):
+        played = {'a.mp4': [100]}
+        self.assertEqual(eviction_order(['c.mp4', 'a.mp4', 'b.mp4'], self.added, played,
+                                        'oldest_added'),
+                         ['a.mp4', 'b.mp4', 'c.mp4'])
+
+    def test_least_recently_played(self):
+        # a was played last (from the staging directory), c never
+        played = {'a.mp4': [0, 100], 'b.mp4': [50, 0], 'c.mp4': [0, 0]}
+        self.assertEqual(eviction_order(['a.mp4', 'b.mp4', 'c.mp4'], self.added, played,
+                                        'least_recently_played'),
+                         ['c.mp4', 'b.mp4', 'a.mp4'])
+
+    def test_never_played_counts_as_added(self):
+        played = {'a.mp4': [15]}
+        self.assertEqual(eviction_order(['a.mp4', 'b.mp4'], self.added, played,
+                                        'least_recently_played'),
+                         ['a.mp4', 'b.mp4'])
+
+
+class PlanSpaceTest(unittest.TestCase):
+
+    def test_fits_without_eviction(self):
+        plan = plan_space(100, 200, 0, 0, [('a.mp4', 50, 50)])
+        self.assertTrue(plan.fits)
+        self.assertEqual(plan.evict, [])
+        self.assertFalse(plan.free_first)
+
+    def test_evicts_in_candidate_order(self):
+        candidates = [('old.mp4', 30, 30), ('older.mp4', 30, 30), ('new.mp4', 30, 30)]
+        plan = plan_space(100, 50, 0, 90, candidates)
+        self.assertTrue(plan.fits)
+        self.assertTrue(plan.free_first)
+        self.assertEqual(plan.evict, ['old.mp4', 'older.mp4'])
+
+    def test_dropped_files_count_when_freed_first(self):
+        plan = plan_space(100, 50, 60, 0, [('a.mp4', 30, 30)])
+        self.assertTrue(plan.fits)
+        self.assertEqual(plan.evict, [])
+
+    def test_max_size_evicts(self):
+        plan = plan_space(40, 1000, 0, 100, [('a.mp4', 30, 30), ('b.mp4', 30, 30)],
+                          max_size=120)
+        self.assertTrue(plan.fits)
+        self.assertEqual(plan.evict, ['a.mp4'])
+        self.assertFalse(plan.free_first)
+
+    def test_does_not_fit(self):
+        plan = plan_space(500, 50, 0, 60, [('a.mp4', 30, 30), ('b.mp4', 30, 30)])
+        self.assertFalse(plan.fits)
+        self.assertEqual(plan.evict, [])
+        self.assertEqual((plan.needed, plan.available), (500, 50))
+
+    def test_hardlinked_files_free_nothing(self):
+        plan = plan_space(100, 50, 0, 30, [('linked.mp4', 30, 0)])
+        self.assertFalse(plan.fits)
+
+    def test_background_copy_cannot_free_first(self):
+        plan = plan_space(100, 50, 80, 30, [('a.mp4', 30, 30)], can_free_first=False)
+        self.assertFalse(plan.fits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from Adafruit_Video_Looper.model import Movie, Playlist
+
+
+def _playlist(count):
+    return Playlist([Movie('/video/{0}.mp4'.format(i)) for i in range(count)])
+
+
+class ShuffleBagTest(unittest.TestCase):
+
+    def test_peek_matches_get_next_across_refill(self):
+        playlist = _playlist(5)
+        playlist.get_next(True)
+        playlist.get_next(True)
+        # the rest of this bag and the beginning of the next one
+        upcoming = playlist.peek(6, True)
+        self.assertEqual(len(upcoming), 6)
+        played = [playlist.get_next(True) for _ in range(6)]
+        self.assertEqual([m.target for m in upcoming], [m.target for m in played])
+
+    def test_every_movie_once_per_bag(self):
+        playlist = _playlist(7)
+        played = [playlist.get_next(True).target for _ in range(14)]
+        expected = sorted(m.target for m in playlist.movies)
+        self.assertEqual(sorted(played[:7]), expected)
+        self.assertEqual(sorted(played[7:]), expected)
+        self.assertNotEqual(played[6], played[7])
+
+    def test_set_next_keeps_bag(self):
+        playlist = _playlist(5)
+        playlist.get_next(True)
+        upcoming = playlist.peek(3, True)
+        playlist.set_next('4.mp4')
+        self.assertEqual(playlist.peek(4, True)[1:], upcoming)
+        self.assertEqual(playlist.get_next(True).filename, '4.mp4')
+        self.assertEqual(playlist.get_next(True), upcoming[0])
+
+    def test_peek_in_order(self):
+        playlist = _playlist(3)
+        playlist.get_next(False)
+        self.assertEqual([m.filename for m in playlist.peek(4)],
+                         ['1.mp4', '2.mp4', '0.mp4', '1.mp4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
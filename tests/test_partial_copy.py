@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Adafruit_Video_Looper.copy_engine import copy_file
+from Adafruit_Video_Looper.copy_sync import new_digest
+from Adafruit_Video_Looper.partial_copy import PartialCopies
+
+
+class PartialCopiesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.target = os.path.join(self.root, 'video')
+        os.mkdir(self.target)
+        self.data = os.urandom(300000)
+        self.src = os.path.join(self.root, 'movie.mp4')
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+        self.partial = PartialCopies(self.target)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _interrupt(self, offset, written):
+        """Leave a partial copy with a checkpoint at offset and written bytes
+        on disk, like a copy that was stopped after the checkpoint.
+        """
+        st = os.stat(self.src)
+        part, _, _ = self.partial.start('movie.mp4', st, ['blake2b'])
+        with open(part, 'wb') as f:
+            f.write(self.data[:written])
+        digest = new_digest()
+        digest.update(self.data[:offset])
+        self.partial.checkpoint('movie.mp4', st, offset, digest.hexdigest())
+        return st
+
+    def _expected(self, algorithm='blake2b'):
+        digest = new_digest(algorithm)
+        digest.update(self.data)
+        return digest.hexdigest()
+
+    def test_resume_after_truncation(self):
+        # data behind the checkpoint is not trusted and written again
+        st = self._interrupt(100000, 150000)
+        part, offset, digests = self.partial.start('movie.mp4', st, ['blake2b', 'sha256'])
+        self.assertEqual(offset, 100000)
+        copy_file(self.src, part, digests=digests, offset=offset)
+        self.assertEqual(digests[0].hexdigest(), self._expected())
+        self.assertEqual(digests[1].hexdigest(), self._expected('sha256'))
+        dst = os.path.join(self.target, 'movie.mp4')
+        self.partial.finish('movie.mp4', dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(part + '.journal'))
+
+    def test_corrupt_prefix_starts_over(self):
+        st = self._interrupt(100000, 100000)
+        part = os.path.join(self.partial.path, 'movie.mp4')
+        with open(part, 'r+b') as f:
+            f.write(b'\0' * 10)
+        _, offset, digests = self.partial.start('movie.mp4', st, ['blake2b'])
+        self.assertEqual(offset, 0)
+        self.assertEqual(digests[0].hexdigest(), new_digest().hexdigest())
+
+    def test_changed_source_starts_over(self):
+        st = self._interrupt(100000, 100000)
+        os.utime(self.src, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        _, offset, _ = self.partial.start('movie.mp4', os.stat(self.src), ['blake2b'])
+        self.assertEqual(offset, 0)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.partial.path, 'movie.mp4.journal')))
+
+    def test_short_file_starts_over(self):
+        st = self._interrupt(100000, 50000)
+        _, offset, _ = self.partial.start('movie.mp4', st, ['blake2b'])
+        self.assertEqual(offset, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from Adafruit_Video_Looper.staging import StagingArea
+
+
+class StagingAreaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.target = os.path.join(self.root, 'video')
+        os.mkdir(self.target)
+        with open(os.path.join(self.target, 'old.mp4'), 'w') as f:
+            f.write('old')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _swap(self):
+        staging = StagingArea(self.target)
+        staging.prepare(lambda name: False)
+        with open(os.path.join(staging.path, 'new.mp4'), 'w') as f:
+            f.write('new')
+        staging.commit()
+
+    def test_commit_replaces_content(self):
+        self._swap()
+        self.assertEqual(os.listdir(self.target), ['new.mp4'])
+        self.assertFalse(os.path.exists(StagingArea(self.target).path))
+
+    def test_commit_keeps_mode(self):
+        os.chmod(self.target, 0o2775)
+        self._swap()
+        self.assertEqual(stat.S_IMODE(os.stat(self.target).st_mode), 0o2775)
+
+    @unittest.skipUnless(hasattr(os, 'geteuid') and os.geteuid() == 0, 'needs root')
+    def test_commit_keeps_owner(self):
+        os.chown(self.target, 1000, 1000)
+        self._swap()
+        st = os.stat(self.target)
+        self.assertEqual((st.st_uid, st.st_gid), (1000, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()